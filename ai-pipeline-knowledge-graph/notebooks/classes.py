@@ -21,33 +21,80 @@ import torch
 import torch.nn as nn
 import numpy as np
 import os
+import hashlib
 from sentence_transformers import SentenceTransformer
 from neo4j import GraphDatabase
 import time
 
 
+def model_identity(model):
+    # name or path the model was loaded from, and its output size
+    try:
+        name = model[0].auto_model.config._name_or_path
+    except (AttributeError, IndexError, KeyError, TypeError):
+        name = model.__class__.__name__
+    return "{}:{}".format(name, model.get_sentence_embedding_dimension())
+
+
 class AdjacencyMatrix:
     def __init__(self, model, embedding_folder):
         super(AdjacencyMatrix, self).__init__()
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.model = model.to(self.device)
         print(next(self.model.parameters()).device)
+        self.model_id = model_identity(self.model)
         self.embedding_folder = embedding_folder
         self.cos = nn.CosineSimilarity(dim=1, eps=1e-6)
 
-    def save_embeddings(self, task_data):
+    def load_content_hashes(self):
+        filepath = os.path.join(self.embedding_folder, 'content_hashes.json')
+        if not os.path.exists(filepath):
+            return {}
+        with open(filepath, 'r') as f:
+            return json.load(f)
+
+    def write_content_hashes(self, content_hashes):
+        # write to a temporary file and swap it in, so an interrupted run never leaves a truncated file
+        filepath = os.path.join(self.embedding_folder, 'content_hashes.json')
+        with open(filepath + '.tmp', 'w') as f:
+            json.dump(content_hashes, f)
+        os.replace(filepath + '.tmp', filepath)
+
+    def save_embeddings(self, task_data, incremental=True, prune=False):
+        """
+        task_data: tasks to embed, keyed by task id
+        incremental: only encode tasks whose name changed (or that have no embedding yet), using the
+        content hashes stored in content_hashes.json in the embedding folder. The model identity is part
+        of the hash, so switching models re-encodes every task instead of reusing the old vectors
+        prune: task_data is the complete task set, so remove the embeddings of tasks that no longer exist
+        """
         print("Creating one-time emebddings as it is not present or creating embeddings as requested by the user..")
         start = time.time()
         print("Start")
+        content_hashes = self.load_content_hashes() if incremental else {}
+        encoded = 0
         for tid in task_data:
             task_dict = task_data[tid]
             task1_name = task_dict['name']
-            embedding = self.model.encode(task1_name)
-            embedding = embedding.tolist()
+            name_hash = hashlib.blake2b((self.model_id + '\n' + task1_name).encode('utf-8'), digest_size=16).hexdigest()
             filename = str(tid) + '.pt'
             filepath = os.path.join(self.embedding_folder, filename)
-            torch.save(embedding, filepath)
-        print("All files saved. Time taken to generate and save files", time.time()-start)
+            if content_hashes.get(str(tid)) == name_hash and os.path.exists(filepath):
+                continue
+            embedding = self.model.encode(task1_name)
+            embedding = embedding.tolist()
+            torch.save(embedding, filepath + '.tmp')
+            os.replace(filepath + '.tmp', filepath)
+            content_hashes[str(tid)] = name_hash
+            encoded += 1
+        if prune:
+            for tid in set(content_hashes) - set(str(t) for t in task_data):
+                filepath = os.path.join(self.embedding_folder, tid + '.pt')
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+                del content_hashes[tid]
+        self.write_content_hashes(content_hashes)
+        print("{} of {} embeddings computed. Time taken to generate and save files".format(encoded, len(task_data)), time.time()-start)
 
 
     def open_embeddings(self, task_data):
@@ -166,7 +213,7 @@ class AdjacencyMatrix:
                 os.mkdir(self.embedding_folder)
             # if compute_embeddings:
             start_time = time.time()
-            self.save_embeddings(tasks_data)
+            self.save_embeddings(tasks_data, prune=True)
             print("Time taken to generate embeddings and store:", time.time()-start_time)
             return 0
             print("Creating Ajacency Matrix..")
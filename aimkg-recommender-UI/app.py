@@ -1,21 +1,91 @@
-from flask import Flask, request, jsonify, render_template
-from utils.recommend import get_recommendations
+from flask import Flask, Response, request, jsonify, render_template
+from functools import wraps
+import threading
+from utils.recommend import get_recommendations, load_catalogs, cache_stats
 import utils.search_graph as search_graph
+import utils.embedding_index as embedding_index
+from utils.schema import bootstrap_schema, SCHEMA_BOOTSTRAP
+import utils.queries as queries
+from utils.autocomplete import autocomplete, autocompleters, load_autocomplete, AUTOCOMPLETE_LIMIT
+from utils.embedding_model import get_embedding_model
+from neo4j.exceptions import Neo4jError, DriverError
 import os
 import json
 
 import logging
+
+try:
+    import orjson  # optional, several times faster than json for the large graph payloads
+except ImportError:
+    orjson = None
+
 # logging.basicConfig(level=logging.DEBUG)
 # logger = logging.getLogger(__name__)
 
-# Get the prepoluated values and keep it ready
-print("Getting dropdown values..")
-DROP_DOWN_VALUES = search_graph.drop_down_values(limit=1000)
+# Make sure the indexes and constraints used by the queries below exist
+if SCHEMA_BOOTSTRAP:
+    print("Checking graph schema..")
+    bootstrap_schema()
+
+# Plan every registered Cypher statement now, so the first requests hit Neo4j's query cache
+print("Warming query plans..")
+queries.warm_up()
+
+# Load the shared embedding model once, instead of on the first recommendation request
+print("Loading embedding model..")
+get_embedding_model()
+
+# Load the embedding files once and keep them resident for all recommendation requests
+print("Loading embedding indexes..")
+embedding_index.load_indexes()
+print("Loading node catalogs..")
+load_catalogs()
+# Name lookups for the search form, replaces the dropdown values shipped with the page
+print("Building autocompletion..")
+load_autocomplete()
 
 
 ##############################
 app = Flask(__name__)
 
+# Requests running the encoder or Neo4j queries at the same time (per process). Further requests wait up to
+# REQUEST_QUEUE_TIMEOUT seconds for a slot and are then rejected with 503 instead of piling up on the worker.
+# Under gunicorn only GUNICORN_THREADS requests run per worker, so the limit must stay below it for requests to
+# ever wait here (and be rejected); see gunicorn.conf.py for the connections queued in front of the threads.
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", 4))
+REQUEST_QUEUE_TIMEOUT = float(os.getenv("REQUEST_QUEUE_TIMEOUT", 10))
+request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+
+def json_response(payload):
+    """
+    jsonify() replacement for the graph payloads, serialized with orjson when it is installed.
+    """
+    if orjson is None:
+        return jsonify(payload)
+    # default=str covers values orjson does not know, e.g. neo4j temporal properties
+    return Response(orjson.dumps(payload, default=str), mimetype='application/json')
+
+
+def limit_concurrency(route):
+    @wraps(route)
+    def limited(*args, **kwargs):
+        if not request_slots.acquire(timeout=REQUEST_QUEUE_TIMEOUT):
+            return jsonify({'error': 'Server busy, please retry'}), 503
+        try:
+            return route(*args, **kwargs)
+        finally:
+            request_slots.release()
+    return limited
+
+
+# Neo4jConnection.query() raises once the driver gave up retrying, report it instead of a 500 page
+@app.errorhandler(Neo4jError)
+@app.errorhandler(DriverError)
+def graph_unavailable(e):
+    print("Graph query failed:", e)
+    return jsonify({'error': 'Graph database unavailable, please retry'}), 503
+
 
 @app.route('/')
 def home():
@@ -30,6 +100,7 @@ def recommendation():
 
 # Route for recommendation query
 @app.route('/recommendation/query', methods=['POST'])
+@limit_concurrency
 def recommend_graphs():
     data = request.json
     dataset = data.get('dataset')
@@ -44,20 +115,37 @@ def recommend_graphs():
     print("Recommendation query processed")
     print(results_readable)
     # json_data = json.dumps(results, sort_keys=False)  # Prevents alphabetical sorting
-    return jsonify(results)
+    return json_response(results)
+
+
+# Hit rates of the query-embedding and recommendation result caches
+@app.route('/recommendation/cache_stats')
+def recommendation_cache_stats():
+    return jsonify(cache_stats())
 
 
 ######################################### SEARCH ####################################
 @app.route('/search')
 def search():
-    return render_template('search.html', 
-                           dropdown_dataset=DROP_DOWN_VALUES['dataset'], 
-                           dropdown_task=DROP_DOWN_VALUES['task'],
-                           dropdown_model=DROP_DOWN_VALUES['model'])
+    return render_template('search.html')
+
+
+# Route for name autocompletion of the search form, e.g. /search/autocomplete?entity=task&q=image
+# The response format is the one expected by the Semantic UI dropdown remote API
+@app.route('/search/autocomplete')
+def search_autocomplete():
+    entity = request.args.get('entity', '')
+    text = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', AUTOCOMPLETE_LIMIT, type=int), 100))
+    if entity not in autocompleters:
+        return jsonify({'success': False, 'error': 'Unknown entity {}'.format(entity)}), 400
+    names = autocomplete(entity, text, limit=limit)
+    return jsonify({'success': True, 'results': [{'name': name, 'value': name} for name in names]})
 
 
 # Route for search query
 @app.route('/search/query', methods=['POST'])
+@limit_concurrency
 def search_query():
     data = request.json
     dataset = data.get('dataset')
@@ -66,17 +154,21 @@ def search_query():
     query_type = data.get('query_type')
     # Process the search-specific query
     d3_graphs = search_graph.search_pipelines(query_task=task, query_dataset=dataset, query_model=model, query_type=query_type)
-    return jsonify(d3_graphs)
+    return json_response(d3_graphs)
 
 
 @app.route('/search/cypher_query', methods=['POST'])
+@limit_concurrency
 def search_cypher_query():
     data = request.json
     cypher_query = data.get('cypher_query')
     print("CYPHER QUERY:", cypher_query)
     d3_graphs = search_graph.search_custom_query(cypher_query)
-    return jsonify(d3_graphs)
+    if 'error' in d3_graphs:
+        return jsonify(d3_graphs), 503 if d3_graphs.get('unavailable') else 400
+    return json_response(d3_graphs)
 
 if __name__ == '__main__':
+    # development server, use `gunicorn -c gunicorn.conf.py app:app` in production
     #app.run(debug=True, port=9089, extra_files=['templates/recommendation.html', 'templates/search.html', 'static/css/styles.css', 'static/js/graph.js','static/js/list.js'])
     app.run(debug=False, port=9089, host='0.0.0.0', extra_files=['templates/recommendation.html', 'templates/search.html', 'static/css/styles.css', 'static/js/graph.js','static/js/list.js'])
@@ -0,0 +1,54 @@
+###
+# Copyright (2024) Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###
+
+"""
+Production serving mode: gunicorn -c gunicorn.conf.py app:app
+The app is preloaded in the master process, so the embedding model, the embedding indexes and the node catalogs
+are loaded once and shared copy-on-write by all workers (the memory-mapped embedding files share the page cache).
+Each worker serves requests from a pool of threads; the Neo4j calls and the encoder release the GIL.
+Of the GUNICORN_THREADS threads of a worker, at most MAX_CONCURRENT_REQUESTS (see app.py) do work at a time; the
+others wait for a slot and return 503 after REQUEST_QUEUE_TIMEOUT, so keep MAX_CONCURRENT_REQUESTS below the
+thread count. Connections beyond the threads are held by the worker up to GUNICORN_WORKER_CONNECTIONS, the rest
+stay in the listen backlog, which bounds the requests queued in front of the app.
+On GPU hosts set GUNICORN_PRELOAD=0 (CUDA cannot be used in a forked child) or run a single worker.
+"""
+
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:9089")
+workers = int(os.getenv("GUNICORN_WORKERS", 2))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 2 * threads))
+backlog = int(os.getenv("GUNICORN_BACKLOG", 64))
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
+
+
+def when_ready(server):
+    # the master used the driver while preloading the app; close it so workers do not inherit its sockets
+    if preload_app:
+        from utils.neo4j_connection import get_connection
+        get_connection().close()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from utils.neo4j_connection import get_connection
+        get_connection().reset()
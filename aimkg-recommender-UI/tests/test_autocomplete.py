@@ -0,0 +1,53 @@
+###
+# Copyright (2024) Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###
+
+
+import sys
+import pytest
+
+# the module also declares the catalogs and queries, so it needs the app dependencies to import
+autocomplete = pytest.importorskip("utils.autocomplete")
+
+KEYS = sorted(['image classification', 'image segmentation', 'imagenet', 'text classification',
+               'image\uffffx', 'image\U0001F600', chr(sys.maxunicode) + 'z'])
+
+
+def matching(prefix):
+    start, end = autocomplete.prefix_range(KEYS, prefix)
+    return KEYS[start:end]
+
+
+def test_prefix_range_matches_keys_starting_with_prefix():
+    assert matching('image ') == ['image classification', 'image segmentation']
+    assert matching('text') == ['text classification']
+    assert matching('video') == []
+
+
+def test_prefix_range_of_empty_prefix_is_every_key():
+    assert matching('') == KEYS
+
+
+def test_prefix_range_includes_keys_beyond_uffff():
+    assert matching('image') == [key for key in KEYS if key.startswith('image')]
+    assert 'image\U0001F600' in matching('image')
+
+
+def test_prefix_range_of_last_code_point():
+    assert matching(chr(sys.maxunicode)) == [chr(sys.maxunicode) + 'z']
+
+
+def test_normalize_name():
+    assert autocomplete.normalize_name('  Image   Classification ') == 'image classification'
@@ -0,0 +1,75 @@
+###
+# Copyright (2024) Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###
+
+
+from utils import cache
+from utils.cache import LRUCache, normalize_query
+
+
+def test_get_counts_hits_and_misses():
+    lru = LRUCache(maxsize=2)
+    assert lru.get('a') == (False, None)
+    lru.put('a', 1)
+    assert lru.get('a') == (True, 1)
+    stats = lru.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_rate']) == (1, 1, 0.5)
+
+
+def test_evicts_least_recently_used():
+    lru = LRUCache(maxsize=2)
+    lru.put('a', 1)
+    lru.put('b', 2)
+    lru.get('a')  # 'b' is now the least recently used
+    lru.put('c', 3)
+    assert lru.get('b') == (False, None)
+    assert lru.get('a') == (True, 1)
+    assert lru.get('c') == (True, 3)
+    assert lru.stats()['size'] == 2
+
+
+def test_put_refreshes_existing_entry():
+    lru = LRUCache(maxsize=2)
+    lru.put('a', 1)
+    lru.put('b', 2)
+    lru.put('a', 10)
+    lru.put('c', 3)
+    assert lru.get('a') == (True, 10)
+    assert lru.get('b') == (False, None)
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    lru = LRUCache(maxsize=2, ttl=10)
+    lru.put('a', 1)
+    now[0] = 109.0
+    assert lru.get('a') == (True, 1)
+    now[0] = 110.0
+    assert lru.get('a') == (False, None)
+    assert lru.stats()['size'] == 0
+
+
+def test_get_or_compute_calls_compute_once():
+    lru = LRUCache(maxsize=2)
+    calls = []
+    compute = lambda: calls.append(1) or len(calls)
+    assert lru.get_or_compute('a', compute) == 1
+    assert lru.get_or_compute('a', compute) == 1
+    assert len(calls) == 1
+
+
+def test_normalize_query_collapses_whitespace():
+    assert normalize_query(' image  classification ') == 'image classification'
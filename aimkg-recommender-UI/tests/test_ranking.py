@@ -0,0 +1,59 @@
+###
+# Copyright (2024) Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###
+
+
+import pytest
+
+torch = pytest.importorskip("torch")
+ranking = pytest.importorskip("utils.ranking")
+
+INF = float('inf')
+
+
+def test_top_k_orders_by_score():
+    rows, scores = ranking.top_k(torch.tensor([0.1, 0.9, 0.5, 0.7]), 3)
+    assert rows == [1, 3, 2]
+    assert scores.tolist() == pytest.approx([0.9, 0.7, 0.5])
+
+
+def test_top_k_drops_scores_below_threshold():
+    rows, scores = ranking.top_k(torch.tensor([0.1, 0.9, 0.5, 0.7]), 3, threshold=0.6)
+    assert rows == [1, 3]
+    assert scores.tolist() == pytest.approx([0.9, 0.7])
+
+
+def test_top_k_keeps_scores_equal_to_threshold():
+    rows, _ = ranking.top_k(torch.tensor([0.5, 0.2]), 2, threshold=0.5)
+    assert rows == [0]
+
+
+def test_top_k_drops_masked_rows():
+    rows, scores = ranking.top_k(torch.tensor([-INF, 0.3, -INF, 0.1]), 3)
+    assert rows == [1, 3]
+    assert scores.tolist() == pytest.approx([0.3, 0.1])
+
+
+def test_top_k_drops_masked_rows_with_negative_threshold():
+    rows, _ = ranking.top_k(torch.tensor([-INF, -0.5, 0.2]), 3, threshold=-1.0)
+    assert rows == [2, 1]
+
+
+def test_top_k_with_nothing_left():
+    rows, scores = ranking.top_k(torch.tensor([-INF, -INF]), 2)
+    assert rows == []
+    assert scores.shape[0] == 0
+    rows, _ = ranking.top_k(torch.tensor([0.1, 0.2]), 2, threshold=0.5)
+    assert rows == []
@@ -0,0 +1,68 @@
+###
+# Copyright (2024) Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###
+
+import pytest
+
+torch = pytest.importorskip("torch")
+set_features = pytest.importorskip("utils.set_features")
+
+ITEM_SETS = [
+    ['image', 'classification'],
+    ['image', 'segmentation', 'medical'],
+    [],
+    ['text', 'classification', 'classification'],
+]
+
+
+def iou(a, b):
+    a, b = set(a), set(b)
+    return len(a & b) / max(len(a | b), 1)
+
+
+@pytest.fixture
+def matrix():
+    return set_features.SetFeatureMatrix(ITEM_SETS)
+
+
+def test_jaccard_matches_python_iou(matrix):
+    query = ['image', 'classification']
+    expected = [iou(item_set, query) for item_set in ITEM_SETS]
+    assert matrix.jaccard(query).tolist() == pytest.approx(expected)
+
+
+def test_jaccard_counts_unknown_query_values_in_union(matrix):
+    # 'unknown' is not in the vocabulary but makes the union of the first item 3
+    assert matrix.jaccard(['image', 'unknown'])[0].item() == pytest.approx(1 / 3)
+
+
+def test_jaccard_empty_sets(matrix):
+    assert matrix.jaccard([]).tolist() == [0.0] * len(ITEM_SETS)
+    assert matrix.jaccard(['image'])[2].item() == 0.0
+
+
+def test_jaccard_of_rows_matches_full_vector(matrix):
+    query = ['image', 'medical', 'classification']
+    full = matrix.jaccard(query)
+    rows = torch.tensor([3, 0, 2, 1], dtype=torch.int64)
+    assert matrix.jaccard(query, rows=rows).tolist() == pytest.approx(full[rows].tolist())
+
+
+def test_jaccard_of_repeated_and_empty_rows(matrix):
+    query = ['image']
+    full = matrix.jaccard(query)
+    rows = torch.tensor([1, 1, 2], dtype=torch.int64)
+    assert matrix.jaccard(query, rows=rows).tolist() == pytest.approx(full[rows].tolist())
+    assert matrix.jaccard(query, rows=torch.tensor([], dtype=torch.int64)).tolist() == []
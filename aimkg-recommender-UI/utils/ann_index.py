@@ -0,0 +1,102 @@
+###
+# Copyright (2024) Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###
+
+"""
+Approximate nearest neighbour (HNSW) indexes over the entity embeddings.
+The index is built offline by compute_embeddings.py and stored next to the h5 file
+(task_embeddings_all.h5 -> task_embeddings_all.hnsw). Labels are the h5 row numbers.
+hnswlib is optional: without it, or without an up-to-date index file, the recommender falls back to exact search.
+This module is imported both from the app (utils.ann_index) and from compute_embeddings.py, so it has no package-relative imports.
+"""
+
+import os
+import h5py
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+ANN_BACKEND = os.getenv("ANN_BACKEND", "hnsw")  # 'hnsw' or 'exact'
+HNSW_M = int(os.getenv("HNSW_M", 16))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", 200))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 128))
+
+
+def ann_available():
+    return hnswlib is not None and ANN_BACKEND == 'hnsw'
+
+
+def ann_index_path(embedding_path):
+    return os.path.splitext(embedding_path)[0] + '.hnsw'
+
+
+def build_ann_index(embedding_path, batch_size=100000):
+    """
+    Build the HNSW index for an embedding file and write it next to it.
+    """
+    if hnswlib is None:
+        print("hnswlib is not installed, skipping ANN index for", embedding_path)
+        return None
+    with h5py.File(embedding_path, 'r') as f:
+        embeddings = f['embeddings']
+        num_items, dim = embeddings.shape
+        index = hnswlib.Index(space='cosine', dim=dim)
+        index.init_index(max_elements=max(num_items, 1), ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+        for start in range(0, num_items, batch_size):
+            end = min(start + batch_size, num_items)
+            index.add_items(np.asarray(embeddings[start:end], dtype=np.float32), np.arange(start, end))
+    filepath = ann_index_path(embedding_path)
+    tmp_filepath = filepath + '.tmp'
+    index.save_index(tmp_filepath)
+    os.replace(tmp_filepath, filepath)
+    print("ANN index with {} items written to {}".format(num_items, filepath))
+    return filepath
+
+
+class HnswIndex:
+    def __init__(self, index):
+        self.index = index
+
+    def search(self, query, k):
+        """
+        query: 1-d float32 array. Returns (rows, cosine similarities), most similar first.
+        """
+        self.index.set_ef(max(HNSW_EF_SEARCH, k))
+        labels, distances = self.index.knn_query(query.reshape(1, -1), k=k)
+        return labels[0], 1.0 - distances[0]
+
+
+def load_ann_index(embedding_path, num_items, dim):
+    """
+    Returns an HnswIndex for the embedding file, or None if ANN search is disabled, unavailable or
+    the index file is missing or older than the embeddings.
+    """
+    if not ann_available():
+        return None
+    filepath = ann_index_path(embedding_path)
+    if not os.path.exists(filepath):
+        return None
+    if os.path.getmtime(filepath) < os.path.getmtime(embedding_path):
+        print("ANN index {} is older than the embeddings, using exact search".format(filepath))
+        return None
+    index = hnswlib.Index(space='cosine', dim=dim)
+    index.load_index(filepath)
+    if index.get_current_count() != num_items:
+        print("ANN index {} does not match the embeddings, using exact search".format(filepath))
+        return None
+    return HnswIndex(index)
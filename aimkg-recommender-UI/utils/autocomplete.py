@@ -0,0 +1,165 @@
+###
+# Copyright (2024) Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###
+
+"""
+Name autocompletion for the search form, served from the node catalogs instead of shipping every name to the page.
+Names are kept in two sorted key arrays, the full lower-cased name and every word-suffix of it, so a prefix lookup
+is a binary search. Full-name prefix matches rank first, then names with a word starting with the query.
+When that gives fewer than `limit` names, the result is completed with fuzzy matches from the Neo4j full-text
+index of the label (created by schema.py).
+"""
+
+import os
+import re
+import sys
+import threading
+from bisect import bisect_left
+from neo4j.exceptions import Neo4jError, DriverError
+from .queries import register
+from .schema import fulltext_index_name
+from .task import task_catalog
+from .dataset import dataset_catalog
+from .model import model_catalog
+
+AUTOCOMPLETE_LIMIT = int(os.getenv("AUTOCOMPLETE_LIMIT", 10))
+AUTOCOMPLETE_FUZZY = os.getenv("AUTOCOMPLETE_FUZZY", "1") == "1"
+FUZZY_MIN_LENGTH = 3
+
+WORD_START = re.compile(r'(?<=[^0-9a-z])[0-9a-z]')
+LUCENE_SPECIAL = re.compile(r'([+\-&|!(){}\[\]^"~*?:\\/])')
+
+
+FUZZY_QUERY = register('autocomplete.fuzzy', """CALL db.index.fulltext.queryNodes($index, $query) YIELD node, score
+            RETURN node.name AS name ORDER BY score DESC LIMIT $limit""",
+                       {'index': fulltext_index_name('Task'), 'query': 'image~', 'limit': AUTOCOMPLETE_LIMIT})
+
+
+def normalize_name(name):
+    return ' '.join(str(name).lower().split())
+
+
+def prefix_range(keys, prefix):
+    """
+    Positions of the keys starting with prefix, keys being sorted.
+    """
+    start = bisect_left(keys, prefix)
+    # the smallest string above every key starting with prefix: its last character incremented,
+    # after dropping trailing characters that are already the last code point
+    upper = prefix.rstrip(chr(sys.maxunicode))
+    if upper == '':
+        return start, len(keys)
+    end = bisect_left(keys, upper[:-1] + chr(ord(upper[-1]) + 1), lo=start)
+    return start, end
+
+
+def fuzzy_query(text):
+    # every word must match, allowing small typos
+    words = [LUCENE_SPECIAL.sub(r'\\\1', word) for word in text.split()]
+    return ' AND '.join(word + '~' for word in words if len(word) > 0)
+
+
+class NameIndex:
+    """
+    Sorted name keys of one catalog version, never modified after the build.
+    """
+    def __init__(self, names, built_for):
+        full = sorted((normalize_name(name), name) for name in names)
+        words = sorted((key[match.start():], name) for key, name in full for match in WORD_START.finditer(key))
+        self.name_keys, self.name_values = [key for key, _ in full], [name for _, name in full]
+        self.word_keys, self.word_values = [key for key, _ in words], [name for _, name in words]
+        self.built_for = built_for
+
+    def prefix_matches(self, query, limit):
+        matches = []
+        seen = set()
+        for keys, values in [(self.name_keys, self.name_values), (self.word_keys, self.word_values)]:
+            start, end = prefix_range(keys, query)
+            for i in range(start, end):
+                if len(matches) >= limit:
+                    return matches
+                if values[i] not in seen:
+                    seen.add(values[i])
+                    matches.append(values[i])
+        return matches
+
+
+class Autocompleter:
+    def __init__(self, catalog, label):
+        self.catalog = catalog
+        self.label = label
+        self.current = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """
+        Returns the current NameIndex, rebuilt first when the catalog changed. A rebuild is published with a
+        single assignment, so a request never sees the keys of one version with the names of another.
+        """
+        self.catalog.refresh()
+        current = self.current
+        if current is None or current.built_for != self.catalog.version:
+            with self._lock:
+                current = self.current
+                if current is None or current.built_for != self.catalog.version:
+                    version = self.catalog.version
+                    names = set(node['name'] for node in self.catalog.nodes.values() if node.get('name'))
+                    current = NameIndex(names, version)
+                    self.current = current
+        return current
+
+    def fuzzy_matches(self, query, limit):
+        parameters = {'index': fulltext_index_name(self.label), 'query': fuzzy_query(query), 'limit': limit}
+        try:
+            res = FUZZY_QUERY.run(parameters)
+        except (Neo4jError, DriverError):
+            # fuzzy matches only complete the prefix matches, which are still returned
+            return []
+        return [record['name'] for record in res if record['name']]
+
+    def complete(self, text, limit=AUTOCOMPLETE_LIMIT):
+        """
+        Up to `limit` names for the typed text, best matches first.
+        """
+        names = self.refresh()
+        query = normalize_name(text)
+        if query == '':
+            return names.name_values[:limit]
+        matches = names.prefix_matches(query, limit)
+        if AUTOCOMPLETE_FUZZY and len(matches) < limit and len(query) >= FUZZY_MIN_LENGTH:
+            seen = set(matches)
+            for name in self.fuzzy_matches(query, limit):
+                if len(matches) >= limit:
+                    break
+                if name not in seen:
+                    seen.add(name)
+                    matches.append(name)
+        return matches
+
+
+autocompleters = {
+    'task': Autocompleter(task_catalog, 'Task'),
+    'dataset': Autocompleter(dataset_catalog, 'Dataset'),
+    'model': Autocompleter(model_catalog, 'Model'),
+}
+
+
+def load_autocomplete():
+    for completer in autocompleters.values():
+        completer.refresh()
+
+
+def autocomplete(entity, text, limit=AUTOCOMPLETE_LIMIT):
+    return autocompleters[entity].complete(text, limit=limit)
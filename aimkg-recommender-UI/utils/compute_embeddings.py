@@ -19,35 +19,40 @@ This needs to be executed once when we set up the demo
 This script computes embeddings for all the task, dataset, model, pipeline_title and pipeline_abstracts
 """
 
-from neo4j_connection import Neo4jConnection
-from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
+from ann_index import build_ann_index
+from queries import register
+from embedding_model import get_embedding_model, model_id
 import os
+import argparse
+import hashlib
 from tqdm import tqdm
-import torch
 import h5py
 import numpy as np
 
-load_dotenv()
-URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
-USER = os.getenv("NEO4J_USER_NAME")
-PASSWORD = os.getenv("NEO4J_PASSWD")
-AUTH = (os.getenv("NEO4J_USER_NAME"), os.getenv("NEO4J_PASSWD"))
+embedding_model = get_embedding_model()
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 256))
+EMBED_CHUNK_SIZE = int(os.getenv("EMBED_CHUNK_SIZE", 16384))
 
-# Instantiate Neo4j connection
-neo4j_obj = Neo4jConnection(uri=URI, 
-                    user=USER,
-                    pwd=PASSWORD)
+# label names cannot be parameters, so every label has its own registered statement (see queries.py)
+ITEM_NODES_QUERIES = {label: register('embeddings.{}.nodes'.format(label), "MATCH (n:{}) RETURN properties(n)".format(label))
+                      for label in ['Task', 'Dataset', 'Model', 'Pipeline']}
 
 
-DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-embedding_model = SentenceTransformer("all-mpnet-base-v2").to(DEVICE)
-EMBED_DIM=768
+def content_hash(text):
+    # hash of the embedded text, stored next to each vector to detect changed items
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
 
 
 class ComputeEmbeddings():
-    def __init__(self, model):
+    def __init__(self, model, batch_size=EMBED_BATCH_SIZE, chunk_size=EMBED_CHUNK_SIZE):
+        """
+        model: SentenceTransformer used to encode the item names
+        batch_size: number of names per forward pass of the model
+        chunk_size: number of names encoded before the rows are written to the h5 file
+        """
         self.embedding_model = model
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
     
     def create_tokens(self, item_name):
         tokens_ = item_name.split(" ")
@@ -64,96 +69,143 @@ class ComputeEmbeddings():
             data_dict[item_id] = curr_dict
         return data_dict
 
+    def reusable_rows(self, filename, item_ids, hashes):
+        """
+        Rows of an existing embedding file whose item and embedded text are unchanged.
+        Returns a dict of position in item_ids -> row in the existing file.
+        """
+        with h5py.File(filename, 'r') as f:
+            if 'content_hash' not in f or f.attrs.get('model') != model_id():
+                print("{} has no content hashes for {}, recomputing all embeddings".format(filename, model_id()))
+                return {}
+            old_rows = {id.decode('utf-8'): (row, content_hash.decode('utf-8'))
+                        for row, (id, content_hash) in enumerate(zip(f['embedding_ids'][:], f['content_hash'][:]))}
+        reuse = {}
+        for i, (item_id, content_hash) in enumerate(zip(item_ids, hashes)):
+            old = old_rows.get(item_id)
+            if old is not None and old[1] == content_hash:
+                reuse[i] = old[0]
+        return reuse
+
+    def save_embeddings(self, filename, item_ids, names, incremental=False):
+        """
+        Encode the names in batches and write them with their item ids and content hashes to an h5 file.
+        Names are sorted by length so each batch holds similar lengths (little padding), and every chunk of
+        encoded rows is written straight into a preallocated dataset. The recommender aligns everything by the
+        embedding_ids dataset, not by position.
+        incremental: reuse the vectors of the existing file for items whose name hash is unchanged, encode only
+        new or changed items and drop items that no longer exist.
+        """
+        hashes = [content_hash(name) for name in names]
+        reuse = {}
+        if incremental and os.path.exists(filename):
+            reuse = self.reusable_rows(filename, item_ids, hashes)
+        reused = sorted(reuse, key=lambda i: reuse[i])  # in row order of the existing file, for sequential reads
+        to_encode = sorted((i for i in range(len(names)) if i not in reuse), key=lambda i: len(names[i]))
+        print("{}: {} unchanged, {} to encode".format(filename, len(reused), len(to_encode)))
+
+        # Write to a temporary file and swap it in, so the recommender (which memory-maps these files) never sees a partial file
+        tmp_filename = filename + '.tmp'
+        with h5py.File(tmp_filename, 'w') as f:
+            f.attrs['model'] = model_id()
+            ids_dset = f.create_dataset('embedding_ids', shape=(len(names),), dtype='S32')  # Store as fixed-length byte strings
+            hash_dset = f.create_dataset('content_hash', shape=(len(names),), dtype='S32')
+            embed_dim = self.embedding_model.get_sentence_embedding_dimension()
+            embed_dset = f.create_dataset('embeddings', shape=(len(names), embed_dim), dtype=np.float32)  # contiguous layout, can be memory-mapped
+            row = 0
+            if len(reused) > 0:
+                with h5py.File(filename, 'r') as old_f:
+                    old_embeds = old_f['embeddings']
+                    for start in range(0, len(reused), self.chunk_size):
+                        chunk = reused[start:start + self.chunk_size]
+                        old_rows = np.array([reuse[i] for i in chunk])
+                        block = old_embeds[old_rows[0]:old_rows[-1] + 1]
+                        embed_dset[row:row + len(chunk)] = block[old_rows - old_rows[0]]
+                        ids_dset[row:row + len(chunk)] = np.array([item_ids[i] for i in chunk], dtype='S32')
+                        hash_dset[row:row + len(chunk)] = np.array([hashes[i] for i in chunk], dtype='S32')
+                        row += len(chunk)
+            for start in tqdm(range(0, len(to_encode), self.chunk_size)):
+                chunk = to_encode[start:start + self.chunk_size]
+                embeddings = self.embedding_model.encode([names[i] for i in chunk], batch_size=self.batch_size,
+                                                         convert_to_numpy=True, show_progress_bar=False)
+                embed_dset[row:row + len(chunk)] = embeddings.astype(np.float32)
+                ids_dset[row:row + len(chunk)] = np.array([item_ids[i] for i in chunk], dtype='S32')
+                hash_dset[row:row + len(chunk)] = np.array([hashes[i] for i in chunk], dtype='S32')
+                row += len(chunk)
+        os.replace(tmp_filename, filename)
+        # HNSW index used by the recommender for sublinear top-k lookups (skipped if hnswlib is not installed)
+        build_ann_index(filename)
+
     def get_item_nodes(self, item):
-        get_nodes_query = """MATCH (n:{}) RETURN properties(n)""" 
-        get_nodes_query = get_nodes_query.format(item)
-        res = neo4j_obj.query(get_nodes_query)
+        res = ITEM_NODES_QUERIES[item].stream()
         data_dict = self.convert_json(res)
         return data_dict
     
-    def task_embeddings(self):
+    def task_embeddings(self, incremental=False):
         task_dict = self.get_item_nodes(item='Task')
         print("Computing task embeddings..")
         task_ids = []
-        task_embeds = []
-        for key in tqdm(task_dict):
+        names = []
+        for key in task_dict:
             curr_item = task_dict[key]
             # if curr_item['source'] == 'papers-with-code' or curr_item['source'] == 'huggingface':
-            item_id = curr_item['itemID']
-            name = curr_item['name']
-            task_ids.append(item_id)
-            embedding = torch.tensor(self.embedding_model.encode(str(name))).cpu()
-            task_embeds.append(embedding)
+            task_ids.append(curr_item['itemID'])
+            names.append(str(curr_item['name']))
             
-        with h5py.File('task_embeddings_all.h5', 'w') as f:
-            f.create_dataset('embedding_ids', data=np.array(task_ids, dtype='S32'))  # Store as fixed-length byte strings
-            f.create_dataset('embeddings', data=np.array(task_embeds))
+        self.save_embeddings('task_embeddings_all.h5', task_ids, names, incremental=incremental)
         return "Task embeddings complete"
     
     
-    def dataset_embeddings(self):
+    def dataset_embeddings(self, incremental=False):
         dataset_dict = self.get_item_nodes(item='Dataset')
         print("Computing dataset embeddings..")
         dataset_ids = []
-        embeddings = []
-        for key in tqdm(dataset_dict):
+        names = []
+        for key in dataset_dict:
             curr_item = dataset_dict[key]
             # if curr_item['source'] == 'papers-with-code' or curr_item['source'] == 'huggingface':
-            item_id = curr_item['itemID']
-            dataset_ids.append(item_id)
-            name = curr_item['name']
-            embedding = torch.tensor(self.embedding_model.encode(str(name))).cpu()
-            embeddings.append(embedding)
+            dataset_ids.append(curr_item['itemID'])
+            names.append(str(curr_item['name']))
         
-        with h5py.File('dataset_embeddings_all.h5', 'w') as f:
-            f.create_dataset('embedding_ids', data=np.array(dataset_ids, dtype='S32'))  # Store as fixed-length byte strings
-            f.create_dataset('embeddings', data=np.array(embeddings))
+        self.save_embeddings('dataset_embeddings_all.h5', dataset_ids, names, incremental=incremental)
         return "Dataset embeddings complete"
     
-    def model_embeddings(self):
+    def model_embeddings(self, incremental=False):
         model_dict = self.get_item_nodes(item='Model')
-        print("Computing dataset embeddings..")
+        print("Computing model embeddings..")
         model_ids = []
-        embeddings = []
-        for key in tqdm(model_dict):
+        names = []
+        for key in model_dict:
             curr_item = model_dict[key]
             # if curr_item['source'] == 'papers-with-code' or curr_item['source'] == 'huggingface':
-            item_id = curr_item['itemID']
-            name = curr_item['name']
-            embedding = torch.tensor(self.embedding_model.encode(str(name))).cpu()
-            model_ids.append(item_id)
-            embeddings.append(embedding)
+            model_ids.append(curr_item['itemID'])
+            names.append(str(curr_item['name']))
 
-        
-        with h5py.File('model_embeddings_all.h5', 'w') as f:
-            f.create_dataset('embedding_ids', data=np.array(model_ids, dtype='S32'))  # Store as fixed-length byte strings
-            f.create_dataset('embeddings', data=np.array(embeddings))
+        self.save_embeddings('model_embeddings_all.h5', model_ids, names, incremental=incremental)
         return "Model embeddings complete"
     
-    def pipeline_embeddings(self):
+    def pipeline_embeddings(self, incremental=False):
         pipeline_dict = self.get_item_nodes(item='Pipeline')
-        print("Computing dataset embeddings..")
+        print("Computing pipeline embeddings..")
         pipeline_ids = []
-        embeddings = []
-        for key in tqdm(pipeline_dict):
+        names = []
+        for key in pipeline_dict:
             curr_item = pipeline_dict[key]
             if curr_item['source'] == 'papers-with-code' or curr_item['source'] == 'huggingface':
-                item_id = curr_item['itemID']
-                name = curr_item['name']
-                embedding = torch.tensor(self.embedding_model.encode(str(name))).cpu()
-                pipeline_ids.append(item_id)
-                embeddings.append(embedding)
+                pipeline_ids.append(curr_item['itemID'])
+                names.append(str(curr_item['name']))
 
-        
-        with h5py.File('pipeline_embeddings_all.h5', 'w') as f:
-            f.create_dataset('embedding_ids', data=np.array(pipeline_ids, dtype='S32'))  # Store as fixed-length byte strings
-            f.create_dataset('embeddings', data=np.array(embeddings))
-    
+        self.save_embeddings('pipeline_embeddings_all.h5', pipeline_ids, names, incremental=incremental)
         return "Pipeline title embeddings complete"
     
 
+parser = argparse.ArgumentParser(description="Compute the embedding files used by the recommender")
+parser.add_argument('--incremental', action='store_true',
+                    help="only encode new or changed items and reuse the vectors of the existing files")
+args = parser.parse_args()
+
 com_obj = ComputeEmbeddings(model=embedding_model)
-com_obj.task_embeddings()
-com_obj.dataset_embeddings()
-com_obj.model_embeddings()
-# com_obj.pipeline_embeddings()
\ No newline at end of file
+com_obj.task_embeddings(incremental=args.incremental)
+com_obj.dataset_embeddings(incremental=args.incremental)
+com_obj.model_embeddings(incremental=args.incremental)
+# com_obj.pipeline_embeddings(incremental=args.incremental)
@@ -14,57 +14,129 @@
 # limitations under the License.
 ###
 
-import neo4j
+import sys
+from neo4j.graph import Node, Relationship
 
-# TODO: Handle node duplicates - create a dict of nodes and append them to node list.
-def neo4j_to_d3(results):
+# frozenset of node labels -> interned display label, shared by all conversions
+_display_labels = {}
+
+
+def display_label(labels):
+    label = _display_labels.get(labels)
+    if label is None:
+        label = sys.intern(list(labels)[0])
+        _display_labels[labels] = label
+    return label
+
+
+def node_key(node):
+    """
+    Id of a node in the D3 graphs: its labels and itemID, or its element id for nodes without an itemID.
+    Internal ids are reused by Neo4j after deletions, so they cannot identify nodes in graphs stored across
+    loads (see pipeline_cards.py).
+    """
+    item_id = node.get('itemID')
+    if item_id is None:
+        return node.element_id
+    return '{}:{}'.format(':'.join(sorted(node.labels)), item_id)
+
+
+class _LimitReached(Exception):
+    pass
+
+
+def neo4j_to_d3(results, max_records=None, max_nodes=None, max_links=None):
     """
     Converts a list of Neo4j query results into D3.js format.
+    Record values can be nodes, relationships, or lists of them (e.g. `collect(DISTINCT n) AS nodes`). Returning
+    pre-deduplicated lists from Cypher avoids transferring the same node once per OPTIONAL MATCH row.
+    Every node and relationship is converted once. Node ids are given by node_key().
     
     Args:
-        results (list): A list of Neo4j query results where each result corresponds to nodes and relationships.
+        results (list): A list of Neo4j query results (iterables of records) where each result corresponds to nodes and relationships.
+        max_records (int): Stop reading after this many records in total, None for no limit.
+        max_nodes (int): Stop reading when a record would add a node beyond this many, None for no limit.
+        max_links (int): Stop reading when a record would add a link beyond this many, None for no limit.
 
     Returns:
         result_d3_graphs (dict): A dictionary with nodes and links suitable for D3.js visualization.
+            "truncated" is True when a limit stopped the conversion before the end of the results.
     """
-    # Initialize a dictionary to hold nodes and links
-    result_d3_graphs = {
-        "nodes": [],
-        "links": []
-    }
-    
-    # Use sets to avoid duplicates
+    nodes = []
+    relationships = []
+    # Use sets to avoid duplicates, keyed on element ids, which are stable within a query
+    nodes_set = set()
+    links_set = set()
+
+    def add(element):
+        # Check if the element is a node
+        if isinstance(element, Node):
+            # Check if the node has been processed already
+            if element.element_id not in nodes_set:
+                if max_nodes is not None and len(nodes) >= max_nodes:
+                    raise _LimitReached()
+                nodes_set.add(element.element_id)
+                nodes.append(element)
+        # Check if the element is a relationship
+        elif isinstance(element, Relationship):
+            link_id = (element.start_node.element_id, element.end_node.element_id, element.type)
+            if link_id not in links_set:
+                if max_links is not None and len(relationships) >= max_links:
+                    raise _LimitReached()
+                links_set.add(link_id)
+                relationships.append(element)
+        elif isinstance(element, list):
+            for item in element:
+                add(item)
+
+    truncated = False
+    num_records = 0
+    try:
+        # Iterate over each Neo4j result
+        for result in results:
+            for record in result:  # Iterate through each Neo4j record
+                if max_records is not None and num_records >= max_records:
+                    raise _LimitReached()
+                num_records += 1
+                for element in record:  # records are tuples of the returned values
+                    add(element)
+    except _LimitReached:
+        truncated = True
+        # D3 cannot draw links to nodes that were cut off
+        relationships = [element for element in relationships
+                         if element.start_node.element_id in nodes_set and element.end_node.element_id in nodes_set]
+
+    # converted last, when the end nodes of every relationship have their properties from the result
+    nodes = [{
+        "id": node_key(node),
+        "labels": display_label(node.labels),
+        "properties": dict(node)  # Convert node properties to a dictionary
+    } for node in nodes]
+    links = [{
+        "source": node_key(element.start_node),
+        "target": node_key(element.end_node),
+        "type": element.type,
+        "properties": dict(element)  # Convert relationship properties to a dictionary
+    } for element in relationships]
+    return {"nodes": nodes, "links": links, "truncated": truncated}
+
+
+def merge_d3_graphs(graphs):
+    """
+    Union of D3 graphs (e.g. precomputed pipeline cards), keeping the first copy of every node and link.
+    """
+    nodes = []
+    links = []
     nodes_set = set()
     links_set = set()
-    # Iterate over each Neo4j result
-    for result in results:
-        for record in result:  # Iterate through each Neo4j record
-            # Extract nodes and relationships from the record
-            # print(type(re))
-            for key in record.keys():
-                element = record[key]
-                
-                # Check if the element is a node
-                if isinstance(element, neo4j.graph.Node):
-                    # Check if the node has been processed already
-                    if element.id not in nodes_set:
-                        nodes_set.add(element.id)
-                        result_d3_graphs["nodes"].append({
-                            "id": element.id,
-                            "labels": list(element.labels)[0],
-                            "properties": dict(element)  # Convert node properties to a dictionary
-                        })
-                # Check if the element is a relationship
-                elif isinstance(element, neo4j.graph.Relationship):
-                    link_id = (element.start_node.id, element.end_node.id, element.type)
-                    
-                    if link_id not in links_set:
-                        links_set.add(link_id)
-                        result_d3_graphs["links"].append({
-                            "source": element.start_node.id,
-                            "target": element.end_node.id,
-                            "type": element.type,
-                            "properties": dict(element)  # Convert relationship properties to a dictionary
-                        })
-
-    return result_d3_graphs
\ No newline at end of file
+    for graph in graphs:
+        for node in graph["nodes"]:
+            if node["id"] not in nodes_set:
+                nodes_set.add(node["id"])
+                nodes.append(node)
+        for link in graph["links"]:
+            link_id = (link["source"], link["target"], link["type"])
+            if link_id not in links_set:
+                links_set.add(link_id)
+                links.append(link)
+    return {"nodes": nodes, "links": links, "truncated": False}
@@ -22,38 +22,20 @@ super_class = ['image', 'text', 'video', 'audio']
 
 
 
-from .neo4j_connection import Neo4jConnection
-from .d3_graph import neo4j_to_d3
-from dotenv import load_dotenv
+from .neo4j_connection import get_connection
+from .pipeline_query import pipeline_graph_query, pipeline_graph_parameters, pipeline_sample_query
+from .queries import register
+from .pipeline_cards import result_graph
+from .node_catalog import NodeCatalog
+from .feature_store import FeatureStore
+from .scoring import HybridScorer
 import os
-import torch
-from sentence_transformers import SentenceTransformer
-import torch.nn.functional as F
 from tqdm import tqdm
 import time
-import h5py
-import glob
 
-DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-# DEVICE = torch.device("cpu")
-embedding_model = SentenceTransformer("all-mpnet-base-v2").to(DEVICE)
 
-load_dotenv()
-URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
-USER = os.getenv("NEO4J_USER_NAME")
-PASSWORD = os.getenv("NEO4J_PASSWD")
-AUTH = (os.getenv("NEO4J_USER_NAME"), os.getenv("NEO4J_PASSWD"))
+neo4j_obj = get_connection()
 
-# Instantiate Neo4j connection
-neo4j_obj = Neo4jConnection(uri=URI, 
-                    user=USER,
-                    pwd=PASSWORD)
-
-def find_file_path(filename, search_directory="."):
-    # Use glob to search recursively in the current directory for the file
-    for file_path in glob.iglob(f"{search_directory}/**/{filename}", recursive=True):
-        return os.path.abspath(file_path)
-    return None
 
 
 def compute_category(item_tokens):
@@ -106,51 +88,31 @@ def create_tokens(tid):
     tokens = tid.split("-")
     return tokens
 
-def convert_json(result):
-    data_dict = {}
-    for item in result:
-        curr_dict = dict(item[0])
-        item_id = curr_dict['itemID']
-        name = curr_dict['name']
-        curr_dict['tokens'] = create_tokens(name)
-        data_dict[item_id] = curr_dict
-    return data_dict
+dataset_catalog = NodeCatalog(neo4j_obj, 'Dataset', create_tokens)
+dataset_features = FeatureStore('dataset', dataset_catalog, {
+    'tokens': lambda node: node['tokens'],
+    'modality': lambda node: node.get('modality', 'none').split(","),
+})
 
 def get_datasets():
-    get_dataset_nodes= """MATCH (n:Dataset) RETURN properties(n)""" 
-    res = neo4j_obj.query(get_dataset_nodes)
-    dataset_dict = convert_json(res)
+    dataset_dict = dataset_catalog.refresh().nodes
     return dataset_dict
 
-def get_dataset_nodes(dataset_id):
-    get_dataset_nodes= """MATCH (n:Dataset {itemID:$id}) RETURN properties(n)""" 
-    parameters = {'id':dataset_id}
-    res = neo4j_obj.query(get_dataset_nodes, parameters)
-    dataset_dict = convert_json(res)
-    return dataset_dict
+# pipeline expansion of the top datasets, built once
+RESULT_PIPELINES_QUERY = register('dataset.result_pipelines',
+                                  pipeline_graph_query('Dataset', "UNWIND $ids AS id MATCH (root:Dataset {itemID:id})"),
+                                  pipeline_graph_parameters(ids=[]), samples={'ids': pipeline_sample_query('Dataset')})
+
 
 def get_result_pipelines(dataset_ids):
     """
-    For the given task ids (top similar ones) get the entire pipeline and return to the main function
+    For the given dataset ids (top similar ones) get the entire pipeline and return to the main function.
+    All ids are expanded in a single round-trip, one row per (dataset, pipeline), see pipeline_query.py.
+    Returns the records, as a list of results for neo4j_to_d3
     """
-    results = []
-    for dataset_id in dataset_ids:
-        query_str = """MATCH (dataset:Dataset {itemID:$dataset_id})
-            OPTIONAL MATCH (dataset)-[r5]-(artifact:Artifact)
-            OPTIONAL MATCH (artifact)-[r6]-(model:Model)
-            OPTIONAL MATCH (artifact)-[r7]-(metric:Metric)
-            OPTIONAL MATCH (artifact)-[r4]-(execution:Execution)
-            OPTIONAL MATCH (execution)-[r3]-(stage:Stage)
-            OPTIONAL MATCH (stage)-[r2]-(pipeline:Pipeline)
-            OPTIONAL MATCH (pipeline)-[r1]-(task:Task)
-            OPTIONAL MATCH (pipeline)-[r8]-(framework:Framework)
-            OPTIONAL MATCH (pipeline)-[r9]-(report:Report)
-            RETURN task, pipeline, stage, execution, artifact, dataset, model, metric, framework, report, r1, r2, r3, r4, r5, r6, r7, r8, r9
-            limit 20"""
-        parameters = {'dataset_id':dataset_id}
-        res = neo4j_obj.query(query_str, parameters)
-        results.append(res)
-    return results
+    parameters = pipeline_graph_parameters(ids=list(dataset_ids))
+    res = RESULT_PIPELINES_QUERY.run(parameters)
+    return [res]
 
 
 def get_explanations(query_task, top_task_ids, task_dict):
@@ -166,64 +128,33 @@ def get_explanations(query_task, top_task_ids, task_dict):
     return explanations
 
 
-def compute_IOU(tokens1, tokens2):
-    return len(set(tokens1).intersection(tokens2))/len(set(tokens1).union(tokens2))
+def get_token_sim(features, query_dataset, rows=None):
+    query_tokens = create_tokens(query_dataset)
+    return features.jaccard('tokens', query_tokens, rows=rows)
 
 
-def get_token_sim(query_dataset, task_dict):
-    query_tokens = create_tokens(query_dataset)
-    sims = []
-    for id in task_dict:
-        sims.append(compute_IOU(query_tokens, task_dict[id]['tokens']))
-    return sims
+def get_modality_sim(features, query_dataset, rows=None):
+    query_modality = compute_modality([i.lower() for i in query_dataset.split(" ")])
+    return features.jaccard('modality', query_modality.split(","), rows=rows)
 
 
-def get_modality_sim(query_dataset, task_dict):
-    query_modality = compute_modality(query_dataset)
-    sims = []
-    for id in task_dict:
-        sims.append(compute_IOU(query_modality.split(","), task_dict[id]['modality'].split(",")))
-    return sims
+dataset_scorer = HybridScorer(dataset_features, {'tokens': get_token_sim, 'modality': get_modality_sim})
 
 
-def get_similar_datasets(query_dataset, num_res=3):
+def get_similar_datasets(query_dataset, num_res=3, sim_threshold=None):
     start_time = time.time()
     num_res=3
     # test - compute just embedding similarity from all the files
-    data_dict = get_datasets()
-
-    filename = 'dataset_embeddings_all.h5'
-    filepath = find_file_path(filename=filename)
-
-    with h5py.File(filepath, 'r') as f:
-        # Load the datasets
-        embedding_ids = f['embedding_ids'][:]  # Reads all the IDs
-        embeddings = f['embeddings'][:]    
-
-    dataset_ids = [id.decode('utf-8') for id in embedding_ids]  # Decode if IDs are stored as byte strings
-    embeddings = torch.tensor(embeddings).to(DEVICE)  # Convert embeddings to a torch tensor
-
-    query_embedding = torch.tensor(embedding_model.encode(str(query_dataset))).view(1, -1).to(DEVICE)
-
-    cos_sim =  F.cosine_similarity(query_embedding, embeddings, dim=1)
-    token_sim = torch.tensor(get_token_sim(query_dataset, data_dict)).to(DEVICE)
-    modality_sim = torch.tensor(get_modality_sim(query_dataset, data_dict)).to(DEVICE)
-
-    mean_sim = (cos_sim + token_sim) / 2
-    # print(mean_sim.device)
+    state = dataset_scorer.refresh()
+    data_dict = state.features.nodes
 
-    # Sort the tensor in descending order and get the indices
-    sorted_tensor, sorted_indices = torch.sort(mean_sim, descending=True)
-    indices = sorted_indices[:num_res]
-    top_ids = [dataset_ids[idx] for idx in indices]
+    top_ids, top_sim_scores = dataset_scorer.top_k(query_dataset, num_res, threshold=sim_threshold, state=state)
     explanations = get_explanations(query_dataset, top_ids, data_dict)
-    neo4j_results = get_result_pipelines(top_ids)
-    result_d3_graphs = neo4j_to_d3(neo4j_results)
+    result_d3_graphs = result_graph('Dataset', top_ids, get_result_pipelines)
+    dataset_nodes = dataset_catalog.get_many(top_ids)
     result_items = {'nodes': result_d3_graphs['nodes'], 'links':result_d3_graphs['links'], 'explanations':explanations}
     print("Time Taken",time.time()-start_time)
-    similar_item_dict = []
-    for id in top_ids:
-        similar_item_dict.append(get_dataset_nodes(id))
+    similar_item_dict = [{id: dataset_nodes[id]} for id in top_ids if id in dataset_nodes]
     return result_items, similar_item_dict
 
 # get_similar_datasets("imagenet")
\ No newline at end of file
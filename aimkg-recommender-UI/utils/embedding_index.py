@@ -0,0 +1,199 @@
+###
+# Copyright (2024) Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###
+
+"""
+Resident embedding index used by the recommender.
+The *_embeddings_all.h5 files written by compute_embeddings.py are opened once, kept in memory
+(memory-mapped when the file layout allows it) and reloaded only when the file changes on disk.
+Top-k lookups use the HNSW index stored next to the h5 file when there is one (see ann_index.py),
+otherwise an exact brute-force search.
+"""
+
+import os
+import glob
+import threading
+import torch
+import h5py
+import numpy as np
+from .ann_index import load_ann_index, ann_index_path
+from .ranking import top_k
+
+DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+EMBEDDINGS_DIR = os.getenv("EMBEDDINGS_DIR", os.path.dirname(os.path.abspath(__file__)))
+
+EMBEDDING_FILES = {
+    'task': 'task_embeddings_all.h5',
+    'dataset': 'dataset_embeddings_all.h5',
+    'model': 'model_embeddings_all.h5',
+    'pipeline': 'pipeline_embeddings_all.h5',
+}
+
+
+def find_file_path(filename, search_directory="."):
+    # Use glob to search recursively in the current directory for the file
+    for file_path in glob.iglob(f"{search_directory}/**/{filename}", recursive=True):
+        return os.path.abspath(file_path)
+    return None
+
+
+def resolve_embedding_path(filename):
+    """
+    Look in EMBEDDINGS_DIR first and fall back to a recursive search of the working directory.
+    Called once per entity type, not per request.
+    """
+    filepath = os.path.join(EMBEDDINGS_DIR, filename)
+    if os.path.exists(filepath):
+        return filepath
+    return find_file_path(filename=filename)
+
+
+def load_embeddings(filepath):
+    """
+    Read the item ids and the embedding matrix from an h5 file.
+    The matrix is memory-mapped when it is stored contiguously (uncompressed, unchunked), otherwise it is read into memory.
+    """
+    with h5py.File(filepath, 'r') as f:
+        embedding_ids = f['embedding_ids'][:]
+        dset = f['embeddings']
+        offset = dset.id.get_offset()
+        if dset.chunks is None and dset.compression is None and offset is not None:
+            # copy-on-write mapping: pages are shared with the page cache and never written back
+            embeddings = np.memmap(filepath, mode='c', dtype=dset.dtype, shape=dset.shape, offset=offset)
+        else:
+            embeddings = dset[:]
+    item_ids = [id.decode('utf-8') for id in embedding_ids]  # Decode if IDs are stored as byte strings
+    return item_ids, embeddings
+
+
+class EmbeddingIndex:
+    """
+    Embedding matrix of one entity type with its item ids in row order, as loaded from one version of the file.
+    Row norms are computed once at load time so a query costs one matrix-vector product.
+    An index is never modified: a reload builds a new one (see EmbeddingFile), so a request that holds an
+    index always sees ids, rows and ANN index of the same file.
+    """
+    def __init__(self, ids, embeddings, inv_norms, ann, version):
+        self.ids = ids
+        self.embeddings = embeddings
+        self.inv_norms = inv_norms
+        self.ann = ann
+        self.version = version  # incremented on every reload, compared by the structures built on the rows
+
+    def similarities(self, query_embedding):
+        """
+        Cosine similarity of the query embedding against every row, in row order.
+        """
+        query = torch.as_tensor(query_embedding, dtype=torch.float32, device=DEVICE).view(-1)
+        query = query / query.norm().clamp_min(1e-8)
+        return torch.mv(self.embeddings, query) * self.inv_norms
+
+    def top_k(self, query_embedding, k, threshold=None, exact=False):
+        """
+        Returns the k most similar item ids and their similarity scores, dropping scores below threshold.
+        Uses the ANN index when one is loaded, unless exact=True.
+        """
+        if self.ann is not None and not exact:
+            query = torch.as_tensor(query_embedding, dtype=torch.float32).view(-1).cpu().numpy()
+            rows, scores = self.ann.search(query, min(k, len(self.ids)))
+            if threshold is not None:
+                keep = scores >= threshold
+                rows, scores = rows[keep], scores[keep]
+            return [self.ids[row] for row in rows.tolist()], torch.tensor(scores, device=DEVICE)
+        rows, scores = top_k(self.similarities(query_embedding), k, threshold=threshold)
+        return [self.ids[row] for row in rows], scores
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class EmbeddingFile:
+    """
+    An h5 embedding file and the index loaded from it, replaced as a whole when the file changes on disk.
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.index = None
+        self._file_stamp = None
+        self._lock = threading.Lock()
+        self.reload()
+
+    def _stamp(self):
+        stat = os.stat(self.filepath)
+        # the ANN index is written after the h5 file, so its mtime is part of the stamp too
+        ann_path = ann_index_path(self.filepath)
+        ann_mtime = os.stat(ann_path).st_mtime_ns if os.path.exists(ann_path) else None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino, ann_mtime)
+
+    def reload(self):
+        with self._lock:
+            stamp = self._stamp()
+            item_ids, embeddings = load_embeddings(self.filepath)
+            embeddings = torch.from_numpy(embeddings).float().to(DEVICE)
+            inv_norms = 1.0 / embeddings.norm(dim=1).clamp_min(1e-8)
+            if DEVICE.type != 'cpu':
+                # the matrix has been copied to the device anyway, so store it normalized
+                embeddings = embeddings * inv_norms.view(-1, 1)
+                inv_norms = torch.ones_like(inv_norms)
+            ann = load_ann_index(self.filepath, num_items=len(item_ids), dim=embeddings.shape[1])
+            version = self.index.version + 1 if self.index is not None else 1
+            # published with a single assignment, requests keep the index they started with
+            self.index = EmbeddingIndex(item_ids, embeddings, inv_norms, ann, version)
+            self._file_stamp = stamp
+            print("Loaded {} embeddings from {} ({} search)".format(len(item_ids), self.filepath, 'hnsw' if ann is not None else 'exact'))
+
+    def refresh(self):
+        """
+        Reload the index if the h5 file (or its ANN index) was replaced or modified since it was loaded.
+        Returns the current index.
+        """
+        if self._stamp() != self._file_stamp:
+            self.reload()
+        return self.index
+
+
+_indexes = {}  # entity type -> EmbeddingFile
+_registry_lock = threading.Lock()
+
+
+def get_index(entity):
+    """
+    Returns the current index for an entity type ('task', 'dataset', 'model' or 'pipeline'),
+    loading it on first use and hot-reloading it when the file has changed.
+    """
+    embedding_file = _indexes.get(entity)
+    if embedding_file is None:
+        with _registry_lock:
+            embedding_file = _indexes.get(entity)
+            if embedding_file is None:
+                filename = EMBEDDING_FILES[entity]
+                filepath = resolve_embedding_path(filename)
+                if filepath is None:
+                    raise FileNotFoundError("Embedding file {} not found. Run compute_embeddings.py first.".format(filename))
+                embedding_file = EmbeddingFile(filepath)
+                _indexes[entity] = embedding_file
+        return embedding_file.index
+    return embedding_file.refresh()
+
+
+def load_indexes(entities=('task', 'dataset', 'model', 'pipeline')):
+    """
+    Load the embedding indexes at startup. Missing files are skipped so the app can still serve the other entity types.
+    """
+    for entity in entities:
+        try:
+            get_index(entity)
+        except FileNotFoundError as e:
+            print(e)
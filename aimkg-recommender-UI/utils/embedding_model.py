@@ -0,0 +1,109 @@
+###
+# Copyright (2024) Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###
+
+"""
+Process-wide sentence embedding model shared by the rankers and compute_embeddings.py.
+The model is loaded once, on first use. EMBED_MODEL_BACKEND selects the inference backend:
+'torch' (default, uses the GPU when available), 'onnx' or 'onnx-quantized' (CPU inference through
+onnxruntime, requires sentence-transformers >= 3.2 with the onnx extra).
+The optional cross-encoder used to rerank recommendation candidates (see scoring.py) is loaded the same way,
+when RERANK_CROSS_ENCODER names one.
+This module is imported both from the app (utils.embedding_model) and from compute_embeddings.py, hence the fallback import below.
+"""
+
+import os
+import threading
+import torch
+from sentence_transformers import SentenceTransformer, CrossEncoder
+try:
+    from .cache import LRUCache, normalize_query
+except ImportError:
+    from cache import LRUCache, normalize_query
+
+DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+EMBED_MODEL_NAME = os.getenv("EMBED_MODEL_NAME", "all-mpnet-base-v2")
+EMBED_MODEL_BACKEND = os.getenv("EMBED_MODEL_BACKEND", "torch")
+# int8 weights published with the model on the Hugging Face hub
+EMBED_ONNX_QUANTIZED_FILE = os.getenv("EMBED_ONNX_QUANTIZED_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 4096))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", 3600))
+RERANK_CROSS_ENCODER = os.getenv("RERANK_CROSS_ENCODER", "")  # e.g. cross-encoder/ms-marco-MiniLM-L-6-v2, empty disables it
+
+# normalized query text -> embedding, users mostly repeat the same dropdown values
+query_embedding_cache = LRUCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+
+_model = None
+_model_lock = threading.Lock()
+_cross_encoder = None
+
+
+def model_id():
+    """
+    Identifies the vectors produced by the model, stored with the embedding files.
+    """
+    if EMBED_MODEL_BACKEND == 'torch':
+        return EMBED_MODEL_NAME
+    return "{}/{}".format(EMBED_MODEL_NAME, EMBED_MODEL_BACKEND)
+
+
+def load_model():
+    print("Loading embedding model {} ({})..".format(EMBED_MODEL_NAME, EMBED_MODEL_BACKEND))
+    if EMBED_MODEL_BACKEND == 'onnx':
+        return SentenceTransformer(EMBED_MODEL_NAME, backend='onnx')
+    if EMBED_MODEL_BACKEND == 'onnx-quantized':
+        return SentenceTransformer(EMBED_MODEL_NAME, backend='onnx', model_kwargs={'file_name': EMBED_ONNX_QUANTIZED_FILE})
+    return SentenceTransformer(EMBED_MODEL_NAME).to(DEVICE)
+
+
+def get_embedding_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = load_model()
+    return _model
+
+
+def encode_query(text):
+    """
+    Embedding of a single query string as a 1-d tensor on DEVICE. Repeated queries are served from query_embedding_cache.
+    """
+    query = normalize_query(text)
+    return query_embedding_cache.get_or_compute(
+        query, lambda: torch.as_tensor(get_embedding_model().encode(query)).view(-1).to(DEVICE))
+
+
+def get_cross_encoder():
+    global _cross_encoder
+    if _cross_encoder is None:
+        with _model_lock:
+            if _cross_encoder is None:
+                print("Loading cross-encoder {}..".format(RERANK_CROSS_ENCODER))
+                _cross_encoder = CrossEncoder(RERANK_CROSS_ENCODER, device=DEVICE.type)
+    return _cross_encoder
+
+
+def cross_encode(query, texts):
+    """
+    Relevance of every text to the query as a 1-d tensor on DEVICE, min-max scaled to [0, 1] over the texts
+    so it can be mixed with the other similarities whatever the output range of the cross-encoder.
+    """
+    if len(texts) == 0:
+        return torch.zeros(0, dtype=torch.float32, device=DEVICE)
+    query = normalize_query(query)
+    scores = torch.as_tensor(get_cross_encoder().predict([(query, text) for text in texts]), dtype=torch.float32).view(-1).to(DEVICE)
+    low, high = scores.min(), scores.max()
+    return (scores - low) / (high - low).clamp_min(1e-8)
@@ -0,0 +1,127 @@
+###
+# Copyright (2024) Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###
+
+"""
+Item features aligned to the rows of an entity's embedding file.
+The `embedding_ids` dataset of <entity>_embeddings_all.h5 is the persisted item index: row i of the
+embedding matrix and element i of every feature column describe the same itemID, so the similarity
+vectors can be combined element-wise without reordering, whatever order Neo4j returns nodes in.
+The store also maps item names to rows, so a query that names a known item (e.g. a dropdown value) reuses
+the stored vector instead of running the encoder.
+"""
+
+import threading
+import torch
+from .embedding_index import get_index, DEVICE
+from .set_features import SetFeatureMatrix
+from .embedding_model import encode_query
+from .cache import normalize_query
+
+
+class Features:
+    """
+    Item features built from one version of the embedding index and of the node catalog.
+    Never modified after the build: FeatureStore.refresh() publishes a new one, so a request that holds it
+    sees rows, ids, features and masks that all belong together.
+    """
+    def __init__(self, index, nodes, ids, rows, built_for, version):
+        """
+        index: EmbeddingIndex the rows belong to
+        nodes: catalog nodes (itemID -> properties) the features were built from
+        rows: list with the node of every row (None for items no longer in the graph)
+        """
+        self.index = index
+        self.nodes = nodes
+        self.ids = ids
+        self.built_for = built_for
+        self.version = version
+        self.features = {}
+        self.present = torch.tensor([node is not None for node in rows], dtype=torch.bool, device=DEVICE)
+        self.num_missing = sum(node is None for node in rows)
+        self.row_of = {id: row for row, id in enumerate(ids)}
+        name_rows = {}
+        for row, node in enumerate(rows):
+            if node is not None:
+                name_rows.setdefault(normalize_query(node['name']), row)
+        self.name_rows = name_rows
+
+    def query_embedding(self, query):
+        """
+        Stored embedding of the item named `query` if there is one, otherwise the encoded query.
+        The stored vectors were computed from the same names with the same model, so the ranking is unchanged.
+        """
+        row = self.name_rows.get(normalize_query(query))
+        if row is not None:
+            return self.index.embeddings[row]
+        return encode_query(query)
+
+    def jaccard(self, name, query_set, rows=None):
+        """
+        IOU of the query set with feature `name` of every item, in embedding row order, or of the given rows only.
+        """
+        return self.features[name].jaccard(query_set, rows=rows)
+
+
+class FeatureStore:
+    def __init__(self, entity, catalog, columns):
+        """
+        entity: embedding index name ('task', 'dataset', 'model' or 'pipeline')
+        catalog: NodeCatalog of the same entity type, source of the node properties
+        columns: dict of feature name -> function returning the set of values of a node.
+                 Only the columns passed to require() are built.
+        """
+        self.entity = entity
+        self.catalog = catalog
+        self.columns = columns
+        self.required = frozenset()
+        self.current = None
+        self._lock = threading.Lock()
+
+    def require(self, names):
+        """
+        Build the given columns from the next refresh on. Called by the scorers with the features they weight,
+        so the sparse matrices of unweighted columns (e.g. all of them for cosine-only rankers) are never built.
+        """
+        with self._lock:
+            self.required = self.required | frozenset(name for name in names if name in self.columns)
+
+    def refresh(self):
+        """
+        Returns the current Features, rebuilt first if the embedding file, the node catalog or the required columns
+        changed since the last build.
+        """
+        index = get_index(self.entity)
+        self.catalog.refresh()
+        current = self.current
+        if current is None or current.built_for != (index.version, self.catalog.version, self.required):
+            with self._lock:
+                current = self.current
+                if current is None or current.built_for != (index.version, self.catalog.version, self.required):
+                    current = self._build(index)
+                    self.current = current
+        return current
+
+    def _build(self, index):
+        # version first: a catalog swap in between leaves it stale, so the next refresh builds again
+        built_for = (index.version, self.catalog.version, self.required)
+        nodes = self.catalog.nodes
+        rows = [nodes.get(id) for id in index.ids]
+        features = Features(index, nodes, index.ids, rows, built_for, self.current.version + 1 if self.current is not None else 1)
+        if features.num_missing > 0:
+            print("Feature store {}: {} embedded items are not in the graph and will not be recommended".format(self.entity, features.num_missing))
+        features.features = {name: SetFeatureMatrix([column(node) if node is not None else [] for node in rows])
+                             for name, column in self.columns.items() if name in self.required}
+        return features
@@ -1,88 +1,48 @@
-from .neo4j_connection import Neo4jConnection
-from .d3_graph import neo4j_to_d3
-from dotenv import load_dotenv
+from .neo4j_connection import get_connection
+from .pipeline_query import pipeline_graph_query, pipeline_graph_parameters, pipeline_sample_query
+from .queries import register
+from .pipeline_cards import result_graph
+from .node_catalog import NodeCatalog
+from .feature_store import FeatureStore
+from .scoring import HybridScorer
 import os
-import torch
-from sentence_transformers import SentenceTransformer
-import torch.nn.functional as F
 from tqdm import tqdm
 import time
-import h5py
-import glob
 
-DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-# DEVICE = torch.device("cpu")
-embedding_model = SentenceTransformer("all-mpnet-base-v2").to(DEVICE)
 
-load_dotenv()
-URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
-USER = os.getenv("NEO4J_USER_NAME")
-PASSWORD = os.getenv("NEO4J_PASSWD")
-AUTH = (os.getenv("NEO4J_USER_NAME"), os.getenv("NEO4J_PASSWD"))
+neo4j_obj = get_connection()
 
-# Instantiate Neo4j connection
-neo4j_obj = Neo4jConnection(uri=URI, 
-                    user=USER,
-                    pwd=PASSWORD)
-
-def find_file_path(filename, search_directory="."):
-    # Use glob to search recursively in the current directory for the file
-    for file_path in glob.iglob(f"{search_directory}/**/{filename}", recursive=True):
-        return os.path.abspath(file_path)
-    return None
 
 
 def create_tokens(tid):
     tokens = tid.split("-")
     return tokens
 
-def convert_json(result):
-    data_dict = {}
-    for item in result:
-        curr_dict = dict(item[0])
-        item_id = curr_dict['itemID']
-        name = curr_dict['name']
-        curr_dict['tokens'] = create_tokens(name)
-        data_dict[item_id] = curr_dict
-    return data_dict
+model_catalog = NodeCatalog(neo4j_obj, 'Model', create_tokens)
+model_features = FeatureStore('model', model_catalog, {
+    'tokens': lambda node: node['tokens'],
+})
 
 def get_models():
-    nodes= """MATCH (n:Model) RETURN properties(n)""" 
-    res = neo4j_obj.query(nodes)
-    data_dict = convert_json(res)
+    data_dict = model_catalog.refresh().nodes
     return data_dict
 
-def get_model_node(id):
-    nodes= """MATCH (n:Model {itemID:$id}) RETURN properties(n)""" 
-    parameters = {'id':id}
-    res = neo4j_obj.query(nodes, parameters)
-    data_dict = convert_json(res)
-    return data_dict
+
+# pipeline expansion of the top models, built once
+RESULT_PIPELINES_QUERY = register('model.result_pipelines',
+                                  pipeline_graph_query('Model', "UNWIND $ids AS id MATCH (root:Model {itemID:id})"),
+                                  pipeline_graph_parameters(ids=[]), samples={'ids': pipeline_sample_query('Model')})
 
 
-# TODO: change the query here
 def get_result_pipelines(model_ids):
     """
-    For the given task ids (top similar ones) get the entire pipeline and return to the main function
+    For the given model ids (top similar ones) get the entire pipeline and return to the main function.
+    All ids are expanded in a single round-trip, one row per (model, pipeline), see pipeline_query.py.
+    Returns the records, as a list of results for neo4j_to_d3
     """
-    results = []
-    for dataset_id in model_ids:
-        query_str = """MATCH (dataset:Dataset {itemID:$dataset_id})
-            OPTIONAL MATCH (dataset)-[r5]-(artifact:Artifact)
-            OPTIONAL MATCH (artifact)-[r6]-(model:Model)
-            OPTIONAL MATCH (artifact)-[r7]-(metric:Metric)
-            OPTIONAL MATCH (artifact)-[r4]-(execution:Execution)
-            OPTIONAL MATCH (execution)-[r3]-(stage:Stage)
-            OPTIONAL MATCH (stage)-[r2]-(pipeline:Pipeline)
-            OPTIONAL MATCH (pipeline)-[r1]-(task:Task)
-            OPTIONAL MATCH (pipeline)-[r8]-(framework:Framework)
-            OPTIONAL MATCH (pipeline)-[r9]-(report:Report)
-            RETURN task, pipeline, stage, execution, artifact, dataset, model, metric, framework, report, r1, r2, r3, r4, r5, r6, r7, r8, r9
-            limit 20"""
-        parameters = {'dataset_id':dataset_id}
-        res = neo4j_obj.query(query_str, parameters)
-        results.append(res)
-    return results
+    parameters = pipeline_graph_parameters(ids=list(model_ids))
+    res = RESULT_PIPELINES_QUERY.run(parameters)
+    return [res]
 
 
 # TODO: Modify as per model features
@@ -99,41 +59,28 @@ def get_explanations(query_model, top_task_ids, task_dict):
     return explanations
 
 
+def get_token_sim(features, query_model, rows=None):
+    query_tokens = create_tokens(query_model)
+    return features.jaccard('tokens', query_tokens, rows=rows)
+
 
+model_scorer = HybridScorer(model_features, {'tokens': get_token_sim})
 
-def get_similar_models(query_model, num_res=3):
+
+def get_similar_models(query_model, num_res=3, sim_threshold=None):
     start_time = time.time()
     num_res=3
     # test - compute just embedding similarity from all the files
-    data_dict = get_models()
-
-    filename = 'model_embeddings_all.h5'
-    filepath = find_file_path(filename=filename)
-    with h5py.File(filepath, 'r') as f:
-        # Load the datasets
-        embedding_ids = f['embedding_ids'][:]  # Reads all the IDs
-        embeddings = f['embeddings'][:]    
-
-    model_ids = [id.decode('utf-8') for id in embedding_ids]  # Decode if IDs are stored as byte strings
-    embeddings = torch.tensor(embeddings).to(DEVICE)  # Convert embeddings to a torch tensor
-
-    query_embedding = torch.tensor(embedding_model.encode(str(query_model))).view(1, -1).to(DEVICE)
-    
+    state = model_scorer.refresh()
+    data_dict = state.features.nodes
 
-    cos_sim =  F.cosine_similarity(query_embedding, embeddings, dim=1)
-    print(len(cos_sim), cos_sim.device)
-    # Sort the tensor in descending order and get the indices
-    sorted_tensor, sorted_indices = torch.sort(cos_sim, descending=True)
-    indices = sorted_indices[:num_res]
-    top_ids = [model_ids[idx] for idx in indices]
+    top_ids, top_sim_scores = model_scorer.top_k(query_model, num_res, threshold=sim_threshold, state=state)
     explanations = get_explanations(query_model, top_ids, data_dict)
-    neo4j_results = get_result_pipelines(top_ids)
-    result_d3_graphs = neo4j_to_d3(neo4j_results)
+    result_d3_graphs = result_graph('Model', top_ids, get_result_pipelines)
+    model_nodes = model_catalog.get_many(top_ids)
     result_items = {'nodes': result_d3_graphs['nodes'], 'links':result_d3_graphs['links'], 'explanations':explanations}
     print("Time Taken",time.time()-start_time)
-    similar_item_dict = []
-    for id in top_ids:
-        similar_item_dict.append(get_model_node(id))
+    similar_item_dict = [{id: model_nodes[id]} for id in top_ids if id in model_nodes]
     return result_items, similar_item_dict
 
 # get_similar_models("clinical llama")
\ No newline at end of file
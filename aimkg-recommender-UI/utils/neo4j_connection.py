@@ -14,10 +14,28 @@
 # limitations under the License.
 ###
 
-from neo4j import GraphDatabase
+from neo4j import GraphDatabase, Query, READ_ACCESS, WRITE_ACCESS
+from dotenv import load_dotenv
+import os
+import atexit
+import threading
 import logging
 
 
+load_dotenv()
+URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
+USER = os.getenv("NEO4J_USER_NAME")
+PASSWORD = os.getenv("NEO4J_PASSWD")
+
+# Driver pool settings, shared by every module of the process
+NEO4J_MAX_POOL_SIZE = int(os.getenv("NEO4J_MAX_POOL_SIZE", 50))
+NEO4J_ACQUISITION_TIMEOUT = float(os.getenv("NEO4J_ACQUISITION_TIMEOUT", 30))  # seconds to wait for a free connection
+NEO4J_MAX_CONNECTION_LIFETIME = float(os.getenv("NEO4J_MAX_CONNECTION_LIFETIME", 3600))
+NEO4J_LIVENESS_CHECK_TIMEOUT = float(os.getenv("NEO4J_LIVENESS_CHECK_TIMEOUT", 60))  # idle time after which a pooled connection is pinged before reuse
+NEO4J_MAX_RETRY_TIME = float(os.getenv("NEO4J_MAX_RETRY_TIME", 15))  # retry budget of managed transactions on transient errors
+NEO4J_FETCH_SIZE = int(os.getenv("NEO4J_FETCH_SIZE", 1000))  # records pulled from the server per batch when streaming
+
+
 # class to establish connection to neo4j
 class Neo4jConnection:
     def __init__(self, uri, user, pwd):
@@ -25,36 +43,114 @@ class Neo4jConnection:
         self.__user = user
         self.__pwd = pwd
         self.__driver = None
+        self._connect()
+
+    def _connect(self):
         try:
-            self.__driver = GraphDatabase.driver(self.__uri, auth=(self.__user, self.__pwd))
+            self.__driver = GraphDatabase.driver(self.__uri, auth=(self.__user, self.__pwd),
+                                                 max_connection_pool_size=NEO4J_MAX_POOL_SIZE,
+                                                 connection_acquisition_timeout=NEO4J_ACQUISITION_TIMEOUT,
+                                                 max_connection_lifetime=NEO4J_MAX_CONNECTION_LIFETIME,
+                                                 liveness_check_timeout=NEO4J_LIVENESS_CHECK_TIMEOUT,
+                                                 max_transaction_retry_time=NEO4J_MAX_RETRY_TIME,
+                                                 keep_alive=True)
             # logger.debug("Neo4j driver initialized successfully.")
         except Exception as e:
             print("Failed to create the driver:", e)
             # logger.error("Failed to initialize Neo4j driver: %s", e)
+
+    def reset(self):
+        """
+        Replace the driver with a new one. Used in processes forked after the driver was used, e.g. gunicorn
+        workers of a preloaded app (see gunicorn.conf.py), so that workers never share pooled sockets.
+        """
+        self.__driver = None
+        self._connect()
             
     def close(self):
         if self.__driver is not None:
             self.__driver.close()
             
-    def query(self, query, parameters=None, db=None):
+    def query(self, query, parameters=None, db=None, access_mode='read'):
+        """
+        Run the query in a managed transaction: the driver retries it on transient errors
+        (leader switch, deadlock, dropped connection) for up to NEO4J_MAX_RETRY_TIME seconds.
+        access_mode: 'read' (default) or 'write'
+        Returns the list of records. Errors are printed and raised once the retries are exhausted,
+        the routes report them as 503 (see app.py).
+        """
         assert self.__driver is not None, "Driver not initialized!"
-        session = None
-        response = None
         try: 
-            session = self.__driver.session(database=db) if db is not None else self.__driver.session() 
-            #response = (session.run(query, parameters))
-            response = list(session.run(query, parameters))
+            # sessions are cheap, the underlying connection comes from the driver pool
+            with self.__driver.session(database=db) as session:
+                # records are consumed inside the transaction function, so a retry never returns a partial result
+                work = lambda tx: list(tx.run(query, parameters))
+                if access_mode == 'write':
+                    response = session.execute_write(work)
+                else:
+                    response = session.execute_read(work)
         except Exception as e:
             print("Query failed:", e)
-        finally: 
-            if session is not None:
-                session.close()
+            raise
         
         #return pd.DataFrame([r.values() for r in response], columns=response.keys())
         return response
         
+    def stream(self, query, parameters=None, db=None, fetch_size=NEO4J_FETCH_SIZE, access_mode='read', timeout=None):
+        """
+        Generator over the records of the query. Records are pulled from the server in batches of fetch_size,
+        so only one batch is held in memory at a time. The session stays open until the generator is exhausted or closed.
+        Unlike query(), a partially consumed stream cannot be retried, so errors are printed and raised.
+        access_mode='read' is enforced by the server: a query that writes fails.
+        timeout: seconds after which the server terminates the transaction, None for the server default
+        """
+        assert self.__driver is not None, "Driver not initialized!"
+        mode = WRITE_ACCESS if access_mode == 'write' else READ_ACCESS
+        try:
+            with self.__driver.session(database=db, fetch_size=fetch_size, default_access_mode=mode) as session:
+                if timeout is not None:
+                    query = Query(query, timeout=timeout)
+                for record in session.run(query, parameters):
+                    yield record
+        except Exception as e:
+            print("Query failed:", e)
+            raise
+
+    def profile(self, query, parameters=None, db=None):
+        """
+        Run the query as PROFILE in a read transaction. Returns the records and the profiled plan
+        (nested dicts with operatorType, rows, dbHits and children). Errors are printed and raised.
+        """
+        assert self.__driver is not None, "Driver not initialized!"
+        try:
+            with self.__driver.session(database=db, default_access_mode=READ_ACCESS) as session:
+                result = session.run("PROFILE " + query, parameters)
+                records = list(result)
+                return records, result.consume().profile
+        except Exception as e:
+            print("Query failed:", e)
+            raise
+
     def multi_query(self, multi_line_query, parameters=None, db=None):
         for li in multi_line_query.splitlines():
                 print(li)
-                result=self.query(li, parameters=None, db=None)
-                print(result)
\ No newline at end of file
+                result=self.query(li, parameters=None, db=None, access_mode='write')
+                print(result)
+
+
+_connection = None
+_connection_lock = threading.Lock()
+
+
+def get_connection():
+    """
+    Process-wide Neo4jConnection. The app, search_graph and the rankers share one driver and its connection pool
+    instead of creating a driver per module.
+    """
+    global _connection
+    if _connection is None:
+        with _connection_lock:
+            if _connection is None:
+                _connection = Neo4jConnection(uri=URI, user=USER, pwd=PASSWORD)
+                atexit.register(_connection.close)
+    return _connection
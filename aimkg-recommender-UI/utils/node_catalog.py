@@ -0,0 +1,175 @@
+###
+# Copyright (2024) Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###
+
+"""
+In-memory catalog of node property maps, keyed by itemID.
+The rankers used to pull every node of a label over Bolt on each request. A catalog loads the label once
+and afterwards compares the itemIDs of the label with its own once per TTL: it fetches the new nodes and
+drops the deleted ones, so loads that add as many nodes as they remove are picked up too. The check runs in a
+background thread while requests keep using the nodes already loaded.
+Properties edited in place (renames, modality, category, source) do not change the ids, so the catalog is
+fully reloaded every NODE_CATALOG_FULL_RELOAD TTL periods as well.
+"""
+
+import os
+import sys
+import time
+import threading
+from .queries import register
+
+NODE_CATALOG_TTL = float(os.getenv("NODE_CATALOG_TTL", 300))
+NODE_CATALOG_FULL_RELOAD = int(os.getenv("NODE_CATALOG_FULL_RELOAD", 12))  # TTL periods between full reloads, 0 disables them
+
+# property values repeated across many nodes that are worth interning
+INTERNED_PROPERTIES = ('source', 'modality', 'category', 'modelClass')
+
+
+def compact_properties(properties):
+    compact = {}
+    for key, value in properties.items():
+        if key in INTERNED_PROPERTIES and isinstance(value, str):
+            value = sys.intern(value)
+        compact[sys.intern(key)] = value
+    return compact
+
+
+class NodeCatalog:
+    def __init__(self, neo4j_obj, label, tokenizer, ttl=NODE_CATALOG_TTL, full_reload=NODE_CATALOG_FULL_RELOAD):
+        """
+        neo4j_obj: Neo4jConnection used to load the nodes
+        label: node label to load, e.g. 'Task'
+        tokenizer: function applied to the node name to fill the 'tokens' property used by the rankers
+        ttl: seconds between checks for changes in the graph
+        full_reload: number of checks between full reloads, which pick up properties edited in place
+        """
+        self.neo4j_obj = neo4j_obj
+        self.label = label
+        self.tokenizer = tokenizer
+        self.ttl = ttl
+        self.full_reload = full_reload
+        self.nodes = {}
+        self.version = 0
+        self._checks = 0
+        self._checked_at = None
+        self._lock = threading.Lock()
+        # label names cannot be parameters, so every label has its own registered statements
+        self.all_query = register('catalog.{}.all'.format(label), "MATCH (n:{}) RETURN properties(n)".format(label), neo4j_obj=neo4j_obj)
+        self.ids_query = register('catalog.{}.ids'.format(label), "MATCH (n:{}) RETURN n.itemID".format(label), neo4j_obj=neo4j_obj)
+        self.nodes_query = register('catalog.{}.nodes'.format(label), "UNWIND $ids AS id MATCH (n:{} {{itemID:id}}) RETURN properties(n)".format(label),
+                                    {'ids': []}, neo4j_obj=neo4j_obj, samples={'ids': "MATCH (n:{}) RETURN n.itemID LIMIT 5".format(label)})
+
+    def _to_node(self, properties):
+        curr_dict = compact_properties(dict(properties))
+        curr_dict['tokens'] = self.tokenizer(curr_dict['name'])
+        return curr_dict
+
+    def _fetch_all(self):
+        # streamed, so only the compacted property maps are kept, not the whole Bolt result
+        nodes = {}
+        for item in self.all_query.stream():
+            curr_dict = self._to_node(item[0])
+            nodes[curr_dict['itemID']] = curr_dict
+        return nodes
+
+    def _fetch_ids(self):
+        return set(item[0] for item in self.ids_query.stream())
+
+    def _fetch_nodes(self, item_ids):
+        res = self.nodes_query.run({'ids': list(item_ids)})
+        return [self._to_node(item[0]) for item in res]
+
+    def load(self):
+        """
+        Full (re)load of all nodes of the label.
+        """
+        with self._lock:
+            self._load()
+        return self
+
+    def _load(self):
+        nodes = self._fetch_all()
+        self._checks = 0
+        self._checked_at = time.monotonic()
+        # an unchanged reload keeps the version, so the features built on the catalog are not rebuilt
+        if self.version == 0 or nodes != self.nodes:
+            self.nodes = nodes
+            self.version += 1
+            print("Node catalog {}: loaded {} nodes".format(self.label, len(self.nodes)))
+
+    def _update(self):
+        """
+        Incremental refresh: only the ids are streamed, and only nodes added or removed since the last load are transferred.
+        """
+        self._checks += 1
+        current_ids = self._fetch_ids()
+        known_ids = set(self.nodes)
+        added_ids = current_ids - known_ids
+        removed_ids = known_ids - current_ids
+        if len(added_ids) == 0 and len(removed_ids) == 0:
+            return
+        # requests may be iterating over self.nodes, so update a copy and swap it in
+        nodes = dict(self.nodes)
+        for item_id in removed_ids:
+            del nodes[item_id]
+        for curr_dict in self._fetch_nodes(added_ids):
+            nodes[curr_dict['itemID']] = curr_dict
+        self.nodes = nodes
+        self.version += 1
+        print("Node catalog {}: {} added, {} removed".format(self.label, len(added_ids), len(removed_ids)))
+
+    def _check(self):
+        """
+        Runs in a background thread started by refresh(), which acquired the lock for it.
+        """
+        try:
+            if self.full_reload > 0 and self._checks + 1 >= self.full_reload:
+                self._load()
+            else:
+                self._update()
+        except Exception as e:
+            # the current nodes stay in use until the next check
+            print("Node catalog {}: check failed: {}".format(self.label, e))
+        finally:
+            self._lock.release()
+
+    def refresh(self, full=False):
+        """
+        Load the catalog on first use, afterwards check for graph changes once per TTL.
+        The check runs in a background thread and requests keep the current nodes meanwhile.
+        full=True forces a complete reload, e.g. after node properties were edited in place.
+        """
+        if full:
+            return self.load()
+        if self._checked_at is None:
+            with self._lock:
+                # another request may have loaded the catalog while this one waited for the lock
+                if self._checked_at is None:
+                    self._load()
+            return self
+        if time.monotonic() - self._checked_at >= self.ttl and self._lock.acquire(blocking=False):
+            # set before the fetch, so the requests arriving meanwhile do not start another check
+            self._checked_at = time.monotonic()
+            threading.Thread(target=self._check, daemon=True).start()
+        return self
+
+    def get(self, item_id):
+        return self.nodes.get(item_id)
+
+    def get_many(self, item_ids):
+        return {item_id: self.nodes[item_id] for item_id in item_ids if item_id in self.nodes}
+
+    def __len__(self):
+        return len(self.nodes)
@@ -19,39 +19,21 @@ super_class = ['image', 'text', 'video', 'audio']
 
 
 
-from .neo4j_connection import Neo4jConnection
-from .d3_graph import neo4j_to_d3
-from dotenv import load_dotenv
+from .neo4j_connection import get_connection
+from .pipeline_query import pipeline_graph_query, pipeline_graph_parameters, pipeline_sample_query
+from .queries import register
+from .pipeline_cards import result_graph
+from .node_catalog import NodeCatalog
+from .feature_store import FeatureStore
+from .scoring import HybridScorer
 import os
-import torch
-from sentence_transformers import SentenceTransformer
-import torch.nn.functional as F
 import time
-import h5py
-import glob
 
-DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-# DEVICE = torch.device("cpu")
-embedding_model = SentenceTransformer("all-mpnet-base-v2").to(DEVICE)
 
-load_dotenv()
-URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
-USER = os.getenv("NEO4J_USER_NAME")
-PASSWORD = os.getenv("NEO4J_PASSWD")
-AUTH = (os.getenv("NEO4J_USER_NAME"), os.getenv("NEO4J_PASSWD"))
+neo4j_obj = get_connection()
 
-# Instantiate Neo4j connection
-neo4j_obj = Neo4jConnection(uri=URI, 
-                    user=USER,
-                    pwd=PASSWORD)
 
 
-def find_file_path(filename, search_directory="."):
-    # Use glob to search recursively in the current directory for the file
-    for file_path in glob.iglob(f"{search_directory}/**/{filename}", recursive=True):
-        return os.path.abspath(file_path)
-    return None
-
 def compute_category(item_tokens):
     tokens = list(item_tokens)
     inter = list(set(tokens).intersection(set(task_category_vocab)))
@@ -103,55 +85,34 @@ def create_tokens(tid):
     tokens = [t.lower() for t in tokens_]
     return tokens
 
-def convert_json(result):
-    data_dict = {}
-    for item in result:
-        curr_dict = dict(item[0])
-        # if curr_dict['source'] == 'papers-with-code' or curr_dict['source'] == 'huggingface':
-        item_id = curr_dict['itemID']
-        name = curr_dict['name']
-        curr_dict['tokens'] = create_tokens(name)
-        data_dict[item_id] = curr_dict
-    return data_dict
+pipeline_catalog = NodeCatalog(neo4j_obj, 'Pipeline', create_tokens)
+pipeline_features = FeatureStore('pipeline', pipeline_catalog, {
+    'tokens': lambda node: node['tokens'],
+    'modality': lambda node: node.get('modality', 'none').split(","),
+    'category': lambda node: node.get('category', 'none').split(","),
+})
 
 def get_pipelines():
-    get_pipeline_nodes= """MATCH (n:Pipeline) RETURN properties(n)""" 
-    res = neo4j_obj.query(get_pipeline_nodes)
-    data_dict = convert_json(res)
+    data_dict = pipeline_catalog.refresh().nodes
     return data_dict
 
-def get_pipeline_node(id):
-    get_pipeline_nodes= """MATCH (n:Pipeline {itemID:$id}) RETURN properties(n)"""
-    parameters = {'id':id}
-    res = neo4j_obj.query(get_pipeline_nodes, parameters)
-    data_dict = convert_json(res)
-    return data_dict
+
+# pipeline expansion of the top pipelines, built once
+RESULT_PIPELINES_QUERY = register('pipeline.result_pipelines',
+                                  pipeline_graph_query('Pipeline', "UNWIND $ids AS id MATCH (root:Pipeline {itemID:id})"),
+                                  pipeline_graph_parameters(ids=[]), samples={'ids': pipeline_sample_query('Pipeline')})
 
 
 def get_result_pipelines(pipeline_ids):
     """
-    For the given task ids (top similar ones) get the entire pipeline and return to the main function
+    For the given pipeline ids (top similar ones) get the entire pipeline and return to the main function.
+    All ids are expanded in a single round-trip, one row per pipeline: the pipeline with the nodes and links of its hops,
+    see pipeline_query.py.
+    Returns the records, as a list of results for neo4j_to_d3
     """
-    results = []
-    for pid in pipeline_ids:
-        query_str = """
-            MATCH (pipeline:Pipeline {itemID:$pipeline_id})
-            OPTIONAL MATCH (pipeline)-[r1]-(task:Task)
-            OPTIONAL MATCH (pipeline)-[r2]-(stage:Stage)
-            OPTIONAL MATCH (stage)-[r3]-(execution:Execution)
-            OPTIONAL MATCH (execution)-[r4]-(artifact:Artifact)
-            OPTIONAL MATCH (artifact)-[r5]-(dataset:Dataset)
-            OPTIONAL MATCH (artifact)-[r6]-(model:Model)
-            OPTIONAL MATCH (artifact)-[r7]-(metric:Metric)
-            OPTIONAL MATCH (pipeline)-[r8]-(framework:Framework)
-            OPTIONAL MATCH (pipeline)-[r9]-(report:Report)
-            RETURN task, pipeline, stage, execution, artifact, dataset, model, metric, framework, report, r1, r2, r3, r4, r5, r6, r7, r8, r9
-            limit 20
-            """
-        parameters = {'pipeline_id':pid}
-        res = neo4j_obj.query(query_str, parameters)
-        results.append(res)
-    return results
+    parameters = pipeline_graph_parameters(ids=list(pipeline_ids))
+    res = RESULT_PIPELINES_QUERY.run(parameters)
+    return [res]
 
 
 def get_explanations(query_task, top_task_ids, top_sim_scores, task_dict):
@@ -166,82 +127,47 @@ def get_explanations(query_task, top_task_ids, top_sim_scores, task_dict):
     return explanations
 
 
-def compute_IOU(tokens1, tokens2):
-    return len(set(tokens1).intersection(tokens2))/len(set(tokens1).union(tokens2))
+def get_token_sim(features, query_task, rows=None):
+    query_tokens = create_tokens(query_task)
+    return features.jaccard('tokens', query_tokens, rows=rows)
 
 
-def get_token_sim(query_task, task_dict):
-    query_tokens = create_tokens(query_task)
-    sims = []
-    for id in task_dict:
-        sims.append(compute_IOU(query_tokens, task_dict[id]['tokens']))
-    return sims
+def get_modality_sim(features, query_task, rows=None):
+    query_modality = compute_modality(create_tokens(query_task))
+    return features.jaccard('modality', query_modality.split(","), rows=rows)
 
 
-def get_modality_sim(query_task, task_dict):
-    query_modality = compute_modality(query_task)
-    sims = []
-    for id in task_dict:
-        sims.append(compute_IOU(query_modality.split(","), task_dict[id]['modality'].split(",")))
-    return sims
+def get_category_sim(features, query_task, rows=None):
+    query_category = compute_category(create_tokens(query_task))
+    return features.jaccard('category', query_category.split(","), rows=rows)
 
 
-def get_category_sim(query_task, task_dict):
-    query_category= compute_category(query_task)
-    sims = []
-    for id in task_dict:
-        sims.append(compute_IOU(query_category.split(","), task_dict[id]['category'].split(",")))
-    return sims
+pipeline_scorer = HybridScorer(pipeline_features, {'tokens': get_token_sim, 'modality': get_modality_sim, 'category': get_category_sim})
 
 
-def get_similar_pipelines(query_pipeline, num_res=10):
+def get_similar_pipelines(query_pipeline, num_res=10, sim_threshold=None):
     print("similar pipeline function called")
     start_time = time.time()
     num_res=3
     # check if we are able to calculate modality or category
     # if there are values, then pass this as constraint and pick only those tasks for similarity computation
-    # Or, use the stored files and compute cosine similarity.. pick top 200 results and compute custom similarity only for those?
+    # The custom similarity is computed only for the top RERANK_CANDIDATES embedding results, see scoring.py
     # have the option to include or exclude modality and category computation in similarity calculation if category and modality are not available
     
     # test - compute just embedding similarity from all the files
-    pipeline_dict = get_pipelines()
-
-
-    filename = 'pipeline_embeddings_all.h5'
-    filepath = find_file_path(filename=filename)
-    with h5py.File(filepath, 'r') as f:
-        # Load the datasets
-        embedding_ids = f['embedding_ids'][:]  # Reads all the IDs
-        embeddings = f['embeddings'][:]    
-
-    pipeline_ids = [id.decode('utf-8') for id in embedding_ids]  # Decode if IDs are stored as byte strings
-    embeddings = torch.tensor(embeddings).to(DEVICE)  # Convert embeddings to a torch tensor
-
-    query_embedding = torch.tensor(embedding_model.encode(str(query_pipeline))).view(1, -1).to(DEVICE)
-
-    cos_sim =  F.cosine_similarity(query_embedding, embeddings, dim=1)
-    # token_sim = torch.tensor(get_token_sim(query_task, task_dict)).to(DEVICE)
-    # modality_sim = torch.tensor(get_modality_sim(query_task, task_dict)).to(DEVICE)
-    # category_sim = torch.tensor(get_category_sim(query_task, task_dict)).to(DEVICE)
-    # print(len(token_sim), len(modality_sim), len(category_sim))
-
-    # mean_sim = (cos_sim + token_sim + modality_sim + category_sim) / 4
+    state = pipeline_scorer.refresh()
+    pipeline_dict = state.features.nodes
 
-    # Sort the tensor in descending order and get the indices
-    sorted_tensor, sorted_indices = torch.sort(cos_sim, descending=True)
-    indices = sorted_indices[:num_res]
-    top_pipeline_ids = [pipeline_ids[idx] for idx in indices]
-    top_sim_scores = sorted_tensor[:num_res]
+    # cosine only by default, the token, modality and category weights are set with SCORING_WEIGHTS
+    top_pipeline_ids, top_sim_scores = pipeline_scorer.top_k(query_pipeline, num_res, threshold=sim_threshold, state=state)
     print("Len of top pipelines:", len(top_pipeline_ids))
     explanations = get_explanations(query_pipeline, top_pipeline_ids, top_sim_scores, pipeline_dict)
-    neo4j_results = get_result_pipelines(top_pipeline_ids)
-    result_d3_graphs = neo4j_to_d3(neo4j_results)
+    result_d3_graphs = result_graph('Pipeline', top_pipeline_ids, get_result_pipelines)
+    pipeline_nodes = pipeline_catalog.get_many(top_pipeline_ids)
     result_items = {'nodes': result_d3_graphs['nodes'], 'links':result_d3_graphs['links'], 'explanations':explanations}
     # print(result_items)
     print("Time Taken:",time.time()-start_time)
-    similar_item_dict = []
-    for id in top_pipeline_ids:
-        similar_item_dict.append(get_pipeline_node(id))
+    similar_item_dict = [{id: pipeline_nodes[id]} for id in top_pipeline_ids if id in pipeline_nodes]
     return result_items, similar_item_dict
 
 # get_similar_pipelines("medical image segmentation")
\ No newline at end of file
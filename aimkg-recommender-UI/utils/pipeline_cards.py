@@ -0,0 +1,228 @@
+###
+# Copyright (2024) Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###
+
+"""
+Materialized "pipeline cards": the D3 graph of every pipeline, precomputed with the same traversal as the
+recommenders' get_result_pipelines (see pipeline_query.py) and stored in a SQLite file as compressed JSON blobs.
+The graph only changes during batch loads, so the recommenders serve the cards instead of expanding pipelines
+on the request path. Items missing from the store (loaded after the last build) are expanded live.
+Rebuild after each load, from the utils folder:
+    python pipeline_cards.py
+This module is imported both from the app (utils.pipeline_cards) and as a script, hence the fallback imports below.
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+from contextlib import closing
+try:
+    from .d3_graph import neo4j_to_d3, merge_d3_graphs
+    from .pipeline_query import pipeline_graph_query, pipeline_paths_query, pipeline_graph_parameters, pipeline_sample_query
+    from .queries import register
+except ImportError:
+    from d3_graph import neo4j_to_d3, merge_d3_graphs
+    from pipeline_query import pipeline_graph_query, pipeline_paths_query, pipeline_graph_parameters, pipeline_sample_query
+    from queries import register
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+PIPELINE_CARDS = os.getenv("PIPELINE_CARDS", "1") == "1"
+PIPELINE_CARDS_FILE = os.getenv("PIPELINE_CARDS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "pipeline_cards.sqlite"))
+PIPELINE_CARDS_BATCH_SIZE = int(os.getenv("PIPELINE_CARDS_BATCH_SIZE", 500))
+# written to the meta table, files of another format are not served. Format 2 keys the nodes on their itemID (see d3_graph.node_key)
+PIPELINE_CARDS_FORMAT = '2'
+
+ROOT_LABELS = ['Task', 'Dataset', 'Model']
+
+CARD_QUERY = register('cards.pipelines',
+                      pipeline_graph_query('Pipeline', "UNWIND $ids AS id MATCH (root:Pipeline {itemID:id})"),
+                      pipeline_graph_parameters(ids=[]), samples={'ids': pipeline_sample_query('Pipeline')})
+PATHS_QUERIES = {label: register('cards.{}.paths'.format(label),
+                                 pipeline_paths_query(label, "UNWIND $ids AS id MATCH (root:%s {itemID:id})" % label),
+                                 pipeline_graph_parameters(ids=[]), samples={'ids': pipeline_sample_query(label)})
+                 for label in ROOT_LABELS}
+ID_QUERIES = {label: register('cards.{}.ids'.format(label), "MATCH (n:{}) RETURN n.itemID".format(label))
+              for label in ROOT_LABELS + ['Pipeline']}
+
+
+def encode_graph(graph):
+    graph = {"nodes": graph["nodes"], "links": graph["links"]}
+    data = orjson.dumps(graph, default=str) if orjson is not None else json.dumps(graph, default=str).encode('utf-8')
+    return zlib.compress(data)
+
+
+def decode_graph(blob):
+    data = zlib.decompress(blob)
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+class PipelineCardStore:
+    """
+    Read side of the card file. A connection is opened per lookup (read-only), which is cheap for SQLite and
+    safe across threads and forked workers. The file is replaced atomically by build_cards().
+    """
+    def __init__(self, filepath=PIPELINE_CARDS_FILE):
+        self.filepath = filepath
+        self._checked_stamp = None
+        self._usable = False
+
+    def available(self):
+        """
+        True when the card file exists and was built in the current format. Graphs of an older format would
+        not merge with the live ones, so the recommenders then expand every pipeline live until the next build.
+        """
+        try:
+            stat = os.stat(self.filepath)
+        except FileNotFoundError:
+            return False
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp != self._checked_stamp:
+            meta = self.meta()
+            self._usable = meta.get('format') == PIPELINE_CARDS_FORMAT
+            if not self._usable:
+                print("Pipeline cards in {} are in format {}, expected {}: rebuild them with pipeline_cards.py".format(
+                    self.filepath, meta.get('format', '1'), PIPELINE_CARDS_FORMAT))
+            self._checked_stamp = stamp
+        return self._usable
+
+    def meta(self):
+        """
+        Build information of the card file (format, built_at).
+        """
+        with closing(self._connect()) as conn:
+            return dict(conn.execute("SELECT key, value FROM meta").fetchall())
+
+    def _connect(self):
+        return sqlite3.connect('file:{}?mode=ro'.format(self.filepath), uri=True)
+
+    def cards(self, pipeline_ids):
+        """
+        pipeline itemID -> D3 graph of the pipeline, for the ids present in the store.
+        """
+        ids = list(pipeline_ids)
+        if len(ids) == 0:
+            return {}
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT pipeline_id, graph FROM cards WHERE pipeline_id IN ({})".format(','.join('?' * len(ids))), ids).fetchall()
+        return {pipeline_id: decode_graph(blob) for pipeline_id, blob in rows}
+
+    def item_paths(self, label, item_ids):
+        """
+        item itemID -> list of (pipeline itemID or None, D3 graph of the path from the item to the pipeline).
+        """
+        ids = list(item_ids)
+        if len(ids) == 0:
+            return {}
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT item_id, pipeline_id, path FROM item_pipelines WHERE label = ? AND item_id IN ({}) ORDER BY rowid".format(
+                ','.join('?' * len(ids))), [label] + ids).fetchall()
+        paths = {}
+        for item_id, pipeline_id, blob in rows:
+            paths.setdefault(item_id, []).append((pipeline_id, decode_graph(blob)))
+        return paths
+
+    def graph(self, label, item_ids):
+        """
+        Merged D3 graph of the stored pipelines of the items, and the ids not found in the store.
+        """
+        if label == 'Pipeline':
+            cards = self.cards(item_ids)
+            return merge_d3_graphs(cards[id] for id in item_ids if id in cards), [id for id in item_ids if id not in cards]
+        paths = self.item_paths(label, item_ids)
+        pipeline_ids = set(pipeline_id for item_paths in paths.values() for pipeline_id, _ in item_paths if pipeline_id is not None)
+        cards = self.cards(pipeline_ids)
+        graphs = []
+        for item_id in item_ids:
+            for pipeline_id, path in paths.get(item_id, []):
+                graphs.append(path)
+                if pipeline_id in cards:
+                    graphs.append(cards[pipeline_id])
+        return merge_d3_graphs(graphs), [id for id in item_ids if id not in paths]
+
+
+card_store = PipelineCardStore()
+
+
+def result_graph(label, item_ids, get_result_pipelines):
+    """
+    D3 graph of the pipelines of the recommended items, from the card store when it has been built,
+    with a live traversal (get_result_pipelines) for the items it does not contain.
+    """
+    if not PIPELINE_CARDS or not card_store.available():
+        neo4j_results = get_result_pipelines(item_ids)
+        return neo4j_to_d3(neo4j_results)
+    stored, missing = card_store.graph(label, item_ids)
+    if len(missing) == 0:
+        return stored
+    neo4j_results = get_result_pipelines(missing)
+    return merge_d3_graphs([stored, neo4j_to_d3(neo4j_results)])
+
+
+def batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def build_cards(filepath=PIPELINE_CARDS_FILE, batch_size=PIPELINE_CARDS_BATCH_SIZE):
+    """
+    Expand every pipeline and the item-to-pipeline paths of every task, dataset and model into a new card file.
+    """
+    start_time = time.time()
+    tmp_filepath = filepath + '.tmp'
+    if os.path.exists(tmp_filepath):
+        os.remove(tmp_filepath)
+    conn = sqlite3.connect(tmp_filepath)
+    conn.execute("CREATE TABLE cards (pipeline_id TEXT PRIMARY KEY, graph BLOB)")
+    conn.execute("CREATE TABLE item_pipelines (label TEXT, item_id TEXT, pipeline_id TEXT, path BLOB)")
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    pipeline_ids = [record[0] for record in ID_QUERIES['Pipeline'].stream()]
+    print("Building {} pipeline cards..".format(len(pipeline_ids)))
+    for batch in batches(pipeline_ids, batch_size):
+        res = CARD_QUERY.run(pipeline_graph_parameters(ids=batch))
+        conn.executemany("INSERT OR REPLACE INTO cards VALUES (?, ?)",
+                         [(record['root']['itemID'], encode_graph(neo4j_to_d3([[record]]))) for record in res])
+
+    for label in ROOT_LABELS:
+        item_ids = [record[0] for record in ID_QUERIES[label].stream()]
+        print("Linking {} {} items to their pipelines..".format(len(item_ids), label))
+        for batch in batches(item_ids, batch_size):
+            res = PATHS_QUERIES[label].run(pipeline_graph_parameters(ids=batch))
+            rows = []
+            for record in res:
+                pipeline = record['pipeline']
+                # the root is part of the path graph, so items without pipelines still show up
+                path = neo4j_to_d3([[(record['root'], record['path_nodes'], record['path_links'])]])
+                rows.append((label, record['root']['itemID'], pipeline['itemID'] if pipeline is not None else None, encode_graph(path)))
+            conn.executemany("INSERT INTO item_pipelines VALUES (?, ?, ?, ?)", rows)
+
+    conn.execute("CREATE INDEX item_pipelines_item ON item_pipelines (label, item_id)")
+    conn.execute("INSERT INTO meta VALUES ('built_at', ?)", (time.strftime('%Y-%m-%dT%H:%M:%S'),))
+    conn.execute("INSERT INTO meta VALUES ('format', ?)", (PIPELINE_CARDS_FORMAT,))
+    conn.commit()
+    conn.close()
+    # replaced atomically, readers open the file per lookup
+    os.replace(tmp_filepath, filepath)
+    print("Pipeline cards written to {} in {:.0f}s".format(filepath, time.time() - start_time))
+
+
+if __name__ == '__main__':
+    build_cards()
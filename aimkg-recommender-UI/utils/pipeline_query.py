@@ -0,0 +1,133 @@
+###
+# Copyright (2024) Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###
+
+"""
+Cypher builder for pipeline expansion, used by the search and by the recommenders.
+A chain of OPTIONAL MATCHes (pipeline -> stage -> execution -> artifact -> dataset/model/metric, ...) produces the
+Cartesian product of all hops before any LIMIT applies. Here every hop is a CALL {} subquery that collects at most
+PIPELINE_HOP_LIMIT neighbours, so a pipeline costs the sum of its hops instead of their product and the query
+returns one row per (root item, pipeline): root, nodes, links.
+"""
+
+import os
+
+PIPELINES_PER_ITEM = int(os.getenv("PIPELINES_PER_ITEM", 5))  # pipelines expanded per root item
+PIPELINE_HOP_LIMIT = int(os.getenv("PIPELINE_HOP_LIMIT", 20))  # nodes collected per hop and pipeline
+PIPELINE_PATH_LIMIT = int(os.getenv("PIPELINE_PATH_LIMIT", 1000))  # root-to-pipeline paths scanned per root item
+
+# Pattern from the root item to its pipelines, None when the root is the pipeline itself
+PIPELINE_PATHS = {
+    'Task': "(root)-[]-(pipeline:Pipeline)",
+    'Dataset': "(root)-[]-(:Artifact)-[]-(:Execution)-[]-(:Stage)-[]-(pipeline:Pipeline)",
+    'Model': "(root)-[]-(:Artifact)-[]-(:Execution)-[]-(:Stage)-[]-(pipeline:Pipeline)",
+    'Pipeline': None,
+}
+
+# (collected list, hop source, neighbour label), a source is either the pipeline or a list collected by an earlier hop
+PIPELINE_HOPS = [
+    ('tasks', 'pipeline', 'Task'),
+    ('frameworks', 'pipeline', 'Framework'),
+    ('reports', 'pipeline', 'Report'),
+    ('stages', 'pipeline', 'Stage'),
+    ('executions', 'stages', 'Execution'),
+    ('artifacts', 'executions', 'Artifact'),
+    ('datasets', 'artifacts', 'Dataset'),
+    ('models', 'artifacts', 'Model'),
+    ('metrics', 'artifacts', 'Metric'),
+]
+
+
+def hop_subquery(target, source, label):
+    if source == 'pipeline':
+        match = """WITH pipeline
+            OPTIONAL MATCH (pipeline)-[r]-(n:{label})""".format(label=label)
+    else:
+        match = """WITH {source}
+            UNWIND {source} AS m
+            OPTIONAL MATCH (m)-[r]-(n:{label})""".format(source=source, label=label)
+    return """
+        CALL {{
+            {match}
+            WITH n, r LIMIT $hop_limit
+            RETURN collect(DISTINCT n) AS {target}, collect(DISTINCT r) AS {target}_links
+        }}""".format(match=match, target=target)
+
+
+def pipeline_expansion():
+    """
+    Fragment expanding a bound `pipeline` (possibly null) hop by hop. Binds pipeline_nodes and pipeline_links.
+    """
+    hops = ''.join(hop_subquery(*hop) for hop in PIPELINE_HOPS)
+    nodes = ' + '.join(target for target, _, _ in PIPELINE_HOPS)
+    links = ' + '.join(target + '_links' for target, _, _ in PIPELINE_HOPS)
+    return hops + """
+        WITH *, [x IN [pipeline] WHERE x IS NOT NULL] + {nodes} AS pipeline_nodes, {links} AS pipeline_links""".format(nodes=nodes, links=links)
+
+
+def pipeline_paths(label):
+    """
+    Fragment binding, for a bound `root`, up to $pipelines_per_item rows of pipeline, path_nodes and path_links.
+    """
+    path = PIPELINE_PATHS[label]
+    if path is None:
+        return """
+        WITH root, root AS pipeline, [] AS path_nodes, [] AS path_links"""
+    # one path per pipeline, so the root and the nodes linking it to the pipeline are part of the graph
+    return """
+        CALL {{
+            WITH root
+            OPTIONAL MATCH p = {path}
+            WITH pipeline, p LIMIT $path_limit
+            WITH pipeline, head(collect(p)) AS p
+            LIMIT $pipelines_per_item
+            RETURN pipeline, coalesce(nodes(p), []) AS path_nodes, coalesce(relationships(p), []) AS path_links
+        }}""".format(path=path)
+
+
+def pipeline_graph_query(label, root_match):
+    """
+    Query returning one row per (root, pipeline) with the columns root, nodes and links.
+    label: label of the root items, selects the path to their pipelines from PIPELINE_PATHS
+    root_match: clause binding `root`, e.g. "UNWIND $ids AS id MATCH (root:Task {itemID:id})"
+    Parameters are given by pipeline_graph_parameters().
+    """
+    return root_match + pipeline_paths(label) + pipeline_expansion() + """
+        RETURN root, path_nodes + pipeline_nodes AS nodes, path_links + pipeline_links AS links"""
+
+
+def pipeline_paths_query(label, root_match):
+    """
+    Query returning one row per (root, pipeline) with the columns root, pipeline, path_nodes and path_links,
+    without expanding the pipelines. Same parameters as pipeline_graph_query().
+    """
+    return root_match + pipeline_paths(label) + """
+        RETURN root, pipeline, path_nodes, path_links"""
+
+
+def pipeline_graph_parameters(pipelines_per_item=PIPELINES_PER_ITEM, **parameters):
+    return dict(parameters, pipelines_per_item=pipelines_per_item, hop_limit=PIPELINE_HOP_LIMIT, path_limit=PIPELINE_PATH_LIMIT)
+
+
+def pipeline_sample_query(label, prop='itemID', limit=5):
+    """
+    Query returning `prop` of a few items of the label that have pipelines. Used to resolve real example
+    parameters when the statements are profiled (see queries.py), instead of ids or names that match nothing.
+    """
+    path = PIPELINE_PATHS[label]
+    where = "root.{} IS NOT NULL".format(prop)
+    if path is not None:
+        where += " AND EXISTS {{ MATCH {} }}".format(path)
+    return "MATCH (root:{}) WHERE {} RETURN root.{} LIMIT {}".format(label, where, prop, limit)
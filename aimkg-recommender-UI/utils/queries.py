@@ -0,0 +1,156 @@
+###
+# Copyright (2024) Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###
+
+"""
+Registry of the Cypher statements of the recommender and the search.
+Every statement is declared once, with a name and example parameters. Statement text never changes between calls
+(values go in parameters), so Neo4j plans each statement once and serves it from its query cache afterwards.
+- warm_up() runs EXPLAIN on every statement at startup, which plans and caches it without executing it.
+- Statements listed in QUERY_PROFILE (comma-separated names, or 'all') run as PROFILE, and the rows and DB hits of
+  every operator are logged.
+- `python -m utils.queries` (from aimkg-recommender-UI) profiles every statement with its example parameters,
+  a plan-regression check to run after the graph has grown. Parameters that need real ids or names are resolved
+  from the graph first (the `samples` of a statement), so the profiled plans do actual work.
+This module is also imported from compute_embeddings.py, hence the fallback import below.
+"""
+
+import os
+try:
+    from .neo4j_connection import get_connection
+except ImportError:
+    from neo4j_connection import get_connection
+
+QUERY_PROFILE = set(name for name in os.getenv("QUERY_PROFILE", "").split(",") if name)
+
+# statement name -> Statement
+REGISTRY = {}
+
+
+class Statement:
+    def __init__(self, name, text, parameters=None, neo4j_obj=None, samples=None):
+        """
+        name: unique name, e.g. 'task.result_pipelines'
+        text: Cypher text, with $parameters for all values
+        parameters: example parameters, used for warm-up and profiling
+        neo4j_obj: connection to run on, the process-wide one by default
+        samples: dict of parameter name -> query returning real values for it in the first column, used for profiling.
+                 List parameters get all the values, other parameters the first one.
+        """
+        self.name = name
+        self.text = text
+        self.parameters = parameters or {}
+        self.neo4j_obj = neo4j_obj
+        self.samples = samples or {}
+
+    @property
+    def connection(self):
+        return self.neo4j_obj or get_connection()
+
+    def profiled(self):
+        return 'all' in QUERY_PROFILE or self.name in QUERY_PROFILE
+
+    def run(self, parameters=None, **kwargs):
+        """
+        Same as Neo4jConnection.query(), run as PROFILE when the statement is listed in QUERY_PROFILE.
+        """
+        if self.profiled():
+            records, _ = self.profile(parameters)
+            return records
+        return self.connection.query(self.text, parameters, **kwargs)
+
+    def stream(self, parameters=None, **kwargs):
+        return self.connection.stream(self.text, parameters, **kwargs)
+
+    def sample_parameters(self):
+        """
+        Example parameters with the sampled values filled in from the graph. Parameters without samples keep their example value.
+        """
+        parameters = dict(self.parameters)
+        for key, sample_query in self.samples.items():
+            try:
+                values = [record[0] for record in self.connection.query(sample_query)]
+            except Exception:
+                continue
+            if len(values) > 0:
+                parameters[key] = values if isinstance(self.parameters.get(key), list) else values[0]
+        return parameters
+
+    def explain(self):
+        return self.connection.query("EXPLAIN " + self.text, self.parameters)
+
+    def profile(self, parameters=None):
+        """
+        Run the statement as PROFILE and log its operator tree. Returns the records and the profile.
+        """
+        records, profile = self.connection.profile(self.text, self.parameters if parameters is None else parameters)
+        print("PROFILE {}: {} rows, {} db hits".format(self.name, len(records), total_db_hits(profile)))
+        for line in format_profile(profile):
+            print(line)
+        return records, profile
+
+
+def register(name, text, parameters=None, neo4j_obj=None, samples=None):
+    statement = Statement(name, text, parameters=parameters, neo4j_obj=neo4j_obj, samples=samples)
+    REGISTRY[name] = statement
+    return statement
+
+
+def operator_stats(profile):
+    args = profile.get('args', {})
+    rows = profile.get('rows', args.get('Rows', 0))
+    db_hits = profile.get('dbHits', args.get('DbHits', 0))
+    return rows, db_hits
+
+
+def total_db_hits(profile):
+    return operator_stats(profile)[1] + sum(total_db_hits(child) for child in profile.get('children', []))
+
+
+def format_profile(profile, depth=0):
+    rows, db_hits = operator_stats(profile)
+    lines = ["{}{} rows={} db_hits={}".format('  ' * (depth + 1), profile.get('operatorType'), rows, db_hits)]
+    for child in profile.get('children', []):
+        lines.extend(format_profile(child, depth + 1))
+    return lines
+
+
+def warm_up():
+    """
+    EXPLAIN every registered statement so that its plan is cached before the first request.
+    """
+    failed = []
+    for name, statement in REGISTRY.items():
+        try:
+            statement.explain()
+        except Exception:
+            failed.append(name)
+    print("Query plans warmed: {} of {}".format(len(REGISTRY) - len(failed), len(REGISTRY)))
+    return failed
+
+
+def profile_all():
+    for statement in REGISTRY.values():
+        try:
+            statement.profile(statement.sample_parameters())
+        except Exception:
+            pass  # already printed by the connection, the other statements are still profiled
+
+
+if __name__ == '__main__':
+    # import the modules that declare statements, then profile all of them
+    import utils.search_graph, utils.autocomplete, utils.recommend  # noqa: F401
+    from utils.queries import profile_all as profile_registered
+    profile_registered()
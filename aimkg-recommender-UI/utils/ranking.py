@@ -0,0 +1,45 @@
+###
+# Copyright (2024) Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###
+
+"""
+Ranking step shared by the task, dataset, model and pipeline recommenders.
+"""
+
+import torch
+
+
+def top_k(scores, k, threshold=None):
+    """
+    Select the k highest scores without sorting the whole vector (torch.topk is a partial selection).
+    scores: 1-d tensor of similarity scores in row order
+    threshold: scores below it are filtered out before the selection; -inf (masked) rows are always dropped
+    Returns the selected row numbers and their scores, most similar first. Fewer than k rows are
+    returned when not enough scores pass the threshold.
+    """
+    if threshold is not None:
+        keep = scores >= threshold
+    else:
+        keep = scores > float('-inf')
+    rows = torch.nonzero(keep).view(-1)
+    if rows.shape[0] < scores.shape[0]:
+        scores = scores[rows]
+    else:
+        rows = None
+    k = min(k, scores.shape[0])
+    top_scores, top_rows = torch.topk(scores, k)
+    if rows is not None:
+        top_rows = rows[top_rows]
+    return top_rows.tolist(), top_scores
@@ -2,28 +2,69 @@
 This will query for the entire pipeline and return it to the front-end
 If more than one element is passed as input, return pipelines that satisfies all
 """
-from .task import get_similar_tasks
-from .dataset import get_similar_datasets
-from .model import get_similar_models
-from .pipeline import get_similar_pipelines
+from .task import get_similar_tasks, task_catalog, task_features, task_scorer
+from .dataset import get_similar_datasets, dataset_catalog, dataset_features, dataset_scorer
+from .model import get_similar_models, model_catalog, model_features, model_scorer
+from .pipeline import get_similar_pipelines, pipeline_scorer
+from .cache import LRUCache, normalize_query
+from .pipeline_cards import card_store
+from .embedding_model import query_embedding_cache
+import os
+
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 1024))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", 300))
+
+# (entity type, normalized query, num_res, sim_threshold) -> (results, similar_item_dict)
+result_cache = LRUCache(maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+
+
+def load_catalogs():
+    """
+    Load the node catalogs and build the sparse set features used by the rankers,
+    so the first recommendation request does not pay for it.
+    The Pipeline catalog is the largest and the least queried, so it is loaded by the first pipeline request instead.
+    """
+    for catalog in [task_catalog, dataset_catalog, model_catalog]:
+        catalog.refresh()
+    for features in [task_features, dataset_features, model_features]:
+        try:
+            features.refresh()
+        except FileNotFoundError as e:
+            print(e)
+
+
+def cached_similar(entity, get_similar, query, num_res, sim_threshold):
+    """
+    Serve repeated (entity type, query, num_res, sim_threshold) requests from result_cache.
+    """
+    key = (entity, normalize_query(query), num_res, sim_threshold)
+    return result_cache.get_or_compute(key, lambda: get_similar(query, num_res=num_res, sim_threshold=sim_threshold))
+
+
+def cache_stats():
+    scorers = {'task': task_scorer, 'dataset': dataset_scorer, 'model': model_scorer, 'pipeline': pipeline_scorer}
+    return {'query_embeddings': query_embedding_cache.stats(), 'results': result_cache.stats(),
+            'scoring': {entity: scorer.stats() for entity, scorer in scorers.items()},
+            'pipeline_cards': card_store.meta() if card_store.available() else None}
+
 
 def get_recommendations(query_task=None, query_dataset=None, query_model=None, query_pipeline=None, num_res=3, sim_threshold=0.1):
     print(type(query_task), type(query_dataset), type(query_model), type(query_pipeline))
     if query_task is not None and query_task != "":
         # print("recommend.py", num_res)
-        task_results, similar_item_dict = get_similar_tasks(query_task, num_res=num_res)
+        task_results, similar_item_dict = cached_similar('task', get_similar_tasks, query_task, num_res, sim_threshold)
         return task_results, similar_item_dict
     
     if query_dataset is not None and query_dataset != "":
-        dataset_results, similar_item_dict = get_similar_datasets(query_dataset, num_res=num_res)
+        dataset_results, similar_item_dict = cached_similar('dataset', get_similar_datasets, query_dataset, num_res, sim_threshold)
         return dataset_results, similar_item_dict
     
     if query_model is not None and query_model != "":
-        model_results, similar_item_dict = get_similar_models(query_model, num_res=num_res)
+        model_results, similar_item_dict = cached_similar('model', get_similar_models, query_model, num_res, sim_threshold)
         return model_results, similar_item_dict
     
     if query_pipeline is not None and query_pipeline != "":
-        pipeline_results, similar_item_dict = get_similar_pipelines(query_pipeline, num_res=num_res)
+        pipeline_results, similar_item_dict = cached_similar('pipeline', get_similar_pipelines, query_pipeline, num_res, sim_threshold)
         return pipeline_results, similar_item_dict
 
 
@@ -0,0 +1,93 @@
+###
+# Copyright (2024) Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###
+
+"""
+Schema bootstrap run by the app at startup.
+Creates, if missing, the indexes and constraints behind the lookups of the recommender and the search:
+- itemID uniqueness constraints (the same ones as the loading notebooks, they also index itemID)
+- range indexes on name, used by the name-equality matches of the search
+- full-text indexes on name and description, used by the autocompletion
+Every statement uses IF NOT EXISTS, so running it again is a no-op. Anything still missing or not online is reported.
+"""
+
+import os
+from .neo4j_connection import get_connection
+
+SCHEMA_BOOTSTRAP = os.getenv("SCHEMA_BOOTSTRAP", "1") == "1"
+
+ITEM_LABELS = ['Pipeline', 'Stage', 'Execution', 'Artifact', 'Task', 'Dataset', 'Model', 'Parameter', 'Metric', 'Framework', 'Report']
+NAME_LABELS = ['Task', 'Dataset', 'Model', 'Pipeline']
+FULLTEXT_LABELS = ['Task', 'Dataset', 'Model']
+
+
+def constraint_name(label):
+    return "{}_id".format(label.lower())
+
+
+def name_index_name(label):
+    return "{}_name".format(label.lower())
+
+
+def fulltext_index_name(label):
+    return "{}_name_fulltext".format(label.lower())
+
+
+def schema_statements():
+    statements = []
+    for label in ITEM_LABELS:
+        statements.append("CREATE CONSTRAINT {} IF NOT EXISTS FOR (n:{}) REQUIRE n.itemID IS UNIQUE".format(constraint_name(label), label))
+    for label in NAME_LABELS:
+        statements.append("CREATE INDEX {} IF NOT EXISTS FOR (n:{}) ON (n.name)".format(name_index_name(label), label))
+    for label in FULLTEXT_LABELS:
+        statements.append("CREATE FULLTEXT INDEX {} IF NOT EXISTS FOR (n:{}) ON EACH [n.name, n.description]".format(fulltext_index_name(label), label))
+    return statements
+
+
+def missing_schema(neo4j_obj):
+    """
+    Names of the expected constraints and indexes that do not exist or are not online (e.g. still populating).
+    """
+    expected = [constraint_name(label) for label in ITEM_LABELS] + \
+               [name_index_name(label) for label in NAME_LABELS] + \
+               [fulltext_index_name(label) for label in FULLTEXT_LABELS]
+    try:
+        constraints = neo4j_obj.query("SHOW CONSTRAINTS YIELD name, ownedIndex")
+        indexes = neo4j_obj.query("SHOW INDEXES YIELD name, state")
+    except Exception:
+        return expected
+    online = set(record['name'] for record in indexes if record['state'] == 'ONLINE')
+    # a constraint is usable once its backing index is online
+    online.update(record['name'] for record in constraints if record['ownedIndex'] in online)
+    return [name for name in expected if name not in online]
+
+
+def bootstrap_schema(neo4j_obj=None):
+    """
+    Idempotently create the constraints and indexes, then report the missing ones.
+    A uniqueness constraint cannot be created while the label has duplicate itemIDs; that is reported, not raised.
+    """
+    neo4j_obj = neo4j_obj or get_connection()
+    for statement in schema_statements():
+        try:
+            neo4j_obj.query(statement, access_mode='write')
+        except Exception:
+            pass  # already printed by the connection, shows up in the missing list below
+    missing = missing_schema(neo4j_obj)
+    if len(missing) > 0:
+        print("Schema: missing or not yet online:", ', '.join(missing))
+    else:
+        print("Schema: all constraints and indexes online")
+    return missing
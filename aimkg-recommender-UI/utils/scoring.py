@@ -0,0 +1,234 @@
+###
+# Copyright (2024) Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###
+
+"""
+Hybrid scoring shared by the task, dataset, model and pipeline recommenders.
+The score of an item is the weighted mean of its similarity vectors, all in embedding row order (see feature_store.py):
+    cosine    embedding cosine similarity
+    tokens    IOU of the name tokens
+    modality  IOU of the modality sets
+    category  IOU of the category sets
+    metrics   1 when the item is linked to Metric nodes in the graph, 0 otherwise
+    cross_encoder  relevance given by the cross-encoder named by RERANK_CROSS_ENCODER, see embedding_model.py
+Items whose source is not in the entity's source filter are excluded from the ranking.
+Ranking runs in two stages: the RERANK_CANDIDATES items most similar to the query embedding are retrieved from the
+index (ANN when one is loaded), and only those are scored with the other features, so the cost of the hybrid score
+does not grow with the catalog. RERANK_CANDIDATES=0 scores every item instead (no cross-encoder then).
+With a source filter, raise RERANK_CANDIDATES so enough candidates pass it.
+Weights and source filters are set per entity with JSON environment variables, e.g.
+    SCORING_WEIGHTS='{"dataset": {"modality": 0.5}, "pipeline": {"tokens": 1, "metrics": 0.2}}'
+    SCORING_SOURCES='{"model": ["huggingface"]}'
+Weights given for an entity are merged with its defaults below, which keep the previous weighting.
+"""
+
+import os
+import json
+import time
+import threading
+import torch
+from .embedding_index import DEVICE
+from .embedding_model import cross_encode, RERANK_CROSS_ENCODER
+from .ranking import top_k
+from .queries import register
+
+DEFAULT_WEIGHTS = {
+    'task': {'cosine': 1.0, 'tokens': 1.0, 'modality': 1.0, 'category': 1.0},
+    'dataset': {'cosine': 1.0, 'tokens': 1.0},
+    'model': {'cosine': 1.0},
+    'pipeline': {'cosine': 1.0},
+}
+SCORING_WEIGHTS = json.loads(os.getenv("SCORING_WEIGHTS", "{}"))
+SCORING_SOURCES = json.loads(os.getenv("SCORING_SOURCES", "{}"))
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", 200))  # stage one candidates per query, 0 scores every item
+
+# Pattern from an item `n` to the metrics reported on it, used for the metric availability feature
+METRIC_PATHS = {
+    'Task': "(n)-[]-(:Pipeline)-[]-(:Stage)-[]-(:Execution)-[]-(:Artifact)-[]-(:Metric)",
+    'Dataset': "(n)-[]-(:Artifact)-[]-(:Metric)",
+    'Model': "(n)-[]-(:Artifact)-[]-(:Metric)",
+    'Pipeline': "(n)-[]-(:Stage)-[]-(:Execution)-[]-(:Artifact)-[]-(:Metric)",
+}
+
+
+def scoring_weights(entity):
+    weights = dict(DEFAULT_WEIGHTS.get(entity, {'cosine': 1.0}))
+    if RERANK_CROSS_ENCODER:
+        weights['cross_encoder'] = 1.0
+    weights.update(SCORING_WEIGHTS.get(entity, {}))
+    return weights
+
+
+class ScoringState:
+    """
+    Source filter and metric availability vectors built for one Features snapshot, never modified after the build.
+    """
+    def __init__(self, features, source_mask, has_metrics):
+        self.features = features
+        self.source_mask = source_mask
+        self.has_metrics = has_metrics
+
+
+class HybridScorer:
+    def __init__(self, features, similarities, weights=None, sources=None, candidates=RERANK_CANDIDATES):
+        """
+        features: FeatureStore of the entity
+        similarities: dict of feature name -> function(features, query, rows=None) returning the similarity vector of the query
+                      in the row order of the Features snapshot (of the given rows only when rows is set), for the features other than
+                      'cosine', 'metrics' and 'cross_encoder'
+        weights: dict of feature name -> weight, defaults to scoring_weights() of the entity
+        sources: list of the item sources to recommend, defaults to SCORING_SOURCES of the entity (None keeps all)
+        candidates: number of items retrieved by embedding similarity and reranked, 0 scores every item
+        """
+        self.features = features
+        self.similarities = similarities
+        self.candidates = candidates
+        if weights is None:
+            weights = scoring_weights(features.entity)
+        known = set(similarities) | {'cosine', 'metrics'}
+        if RERANK_CROSS_ENCODER and candidates > 0:
+            # too slow to run over every item, so only available in the rerank stage
+            known.add('cross_encoder')
+        unknown = [name for name in weights if name not in known]
+        if len(unknown) > 0:
+            print("Scoring {}: ignoring weights of unknown features {}".format(features.entity, unknown))
+        # zero weights are dropped, so their similarity vectors are never computed
+        self.weights = {name: float(weight) for name, weight in weights.items() if name in known and weight}
+        if len(self.weights) == 0:
+            self.weights = {'cosine': 1.0}
+        features.require(self.weights)
+        self.sources = sources if sources is not None else SCORING_SOURCES.get(features.entity)
+        label = features.catalog.label
+        self.metrics_query = register('scoring.{}.with_metrics'.format(label),
+                                      "MATCH (n:{}) WHERE EXISTS {{ MATCH {} }} RETURN n.itemID".format(label, METRIC_PATHS[label]),
+                                      neo4j_obj=features.catalog.neo4j_obj)
+        self.state = None
+        self._lock = threading.Lock()
+        # per-stage timings, see stats()
+        self._requests = 0
+        self._retrieve_time = 0.0
+        self._rerank_time = 0.0
+
+    def refresh(self):
+        """
+        Returns the current ScoringState, rebuilt first when the features were rebuilt.
+        """
+        features = self.features.refresh()
+        state = self.state
+        if state is None or state.features is not features:
+            with self._lock:
+                state = self.state
+                if state is None or state.features is not features:
+                    state = self._build(features)
+                    self.state = state
+        return state
+
+    def _build(self, features):
+        source_mask = None
+        has_metrics = None
+        if self.sources:
+            sources = set(self.sources)
+            nodes = [features.nodes.get(id) for id in features.ids]
+            source_mask = torch.tensor([node is not None and node.get('source') in sources for node in nodes],
+                                       dtype=torch.bool, device=DEVICE)
+        if 'metrics' in self.weights:
+            with_metrics = set(record[0] for record in self.metrics_query.stream())
+            has_metrics = torch.tensor([id in with_metrics for id in features.ids], dtype=torch.float32, device=DEVICE)
+        return ScoringState(features, source_mask, has_metrics)
+
+    def scores(self, state, query, query_embedding, rows=None, cosine=None):
+        """
+        Weighted mean of the similarity vectors of the query, in row order, or for the given rows only
+        (1-d int64 tensor) in the order of `rows`. Excluded rows are -inf.
+        state: ScoringState returned by refresh(), so every vector comes from the same build
+        cosine: embedding similarities of `rows` when already known from the retrieval stage
+        """
+        features = state.features
+        total = None
+        for name, weight in self.weights.items():
+            if name == 'cosine':
+                if cosine is None:
+                    cosine = features.index.similarities(query_embedding)
+                    if rows is not None:
+                        cosine = cosine[rows]
+                sim = cosine
+            elif name == 'metrics':
+                sim = state.has_metrics if rows is None else state.has_metrics[rows]
+            elif name == 'cross_encoder':
+                sim = cross_encode(query, [(features.nodes.get(features.ids[row]) or {}).get('name', '') for row in rows.tolist()])
+            else:
+                sim = self.similarities[name](features, query, rows=rows)
+            total = weight * sim if total is None else total + weight * sim
+        scores = total / sum(self.weights.values())
+        present = features.present if rows is None else features.present[rows]
+        scores = scores.masked_fill(~present, float('-inf'))
+        if self.sources:
+            source_mask = state.source_mask if rows is None else state.source_mask[rows]
+            scores = scores.masked_fill(~source_mask, float('-inf'))
+        return scores
+
+    def top_k(self, query, k, threshold=None, state=None):
+        """
+        Returns the k best scoring item ids and their scores, dropping scores below threshold.
+        state: ScoringState to rank with, defaults to refresh(). Callers that look the ids up in
+               state.features.nodes pass it, so the ids and the nodes come from the same build.
+        """
+        start_time = time.time()
+        if state is None:
+            state = self.refresh()
+        features = state.features
+        query_embedding = features.query_embedding(query)  # skips the encoder for known names
+        if list(self.weights) == ['cosine'] and not self.sources:
+            # pure embedding ranking, served by the ANN index when one is loaded. Rows no longer in the graph
+            # are dropped afterwards, so as many extra results are asked for as there are such rows
+            top_ids, top_scores = features.index.top_k(query_embedding, k + features.num_missing, threshold=threshold)
+            if features.num_missing > 0:
+                rows = torch.tensor([features.row_of[id] for id in top_ids], dtype=torch.int64, device=DEVICE)
+                keep = torch.nonzero(features.present[rows]).view(-1)[:k]
+                top_ids = [top_ids[i] for i in keep.tolist()]
+                top_scores = top_scores[keep]
+            self._record(time.time() - start_time, 0.0)
+            return top_ids, top_scores
+        if self.candidates <= 0:
+            retrieved_time = time.time()
+            num_scored = len(features.ids)
+            rows, top_scores = top_k(self.scores(state, query, query_embedding), k, threshold=threshold)
+            top_ids = [features.ids[row] for row in rows]
+        else:
+            # stage one: embedding candidates
+            candidate_ids, cosine = features.index.top_k(query_embedding, max(self.candidates, k))
+            rows = torch.tensor([features.row_of[id] for id in candidate_ids], dtype=torch.int64, device=DEVICE)
+            retrieved_time = time.time()
+            num_scored = len(candidate_ids)
+            # stage two: hybrid score of the candidates only
+            picked, top_scores = top_k(self.scores(state, query, query_embedding, rows=rows, cosine=cosine), k, threshold=threshold)
+            top_ids = [candidate_ids[i] for i in picked]
+        end_time = time.time()
+        self._record(retrieved_time - start_time, end_time - retrieved_time)
+        print("Scoring {}: retrieve {:.1f} ms, rerank {:.1f} ms ({} items scored)".format(
+            self.features.entity, (retrieved_time - start_time) * 1000, (end_time - retrieved_time) * 1000, num_scored))
+        return top_ids, top_scores
+
+    def _record(self, retrieve_time, rerank_time):
+        with self._lock:
+            self._requests += 1
+            self._retrieve_time += retrieve_time
+            self._rerank_time += rerank_time
+
+    def stats(self):
+        requests = max(self._requests, 1)
+        return {'weights': self.weights, 'candidates': self.candidates, 'requests': self._requests,
+                'mean_retrieve_ms': round(self._retrieve_time / requests * 1000, 3),
+                'mean_rerank_ms': round(self._rerank_time / requests * 1000, 3)}
@@ -15,123 +15,85 @@
 ###
 
 
-from .neo4j_connection import Neo4jConnection
-from dotenv import load_dotenv
+from .neo4j_connection import get_connection, NEO4J_FETCH_SIZE
+from neo4j.exceptions import Neo4jError, DriverError
 import os
 import random
+from concurrent.futures import ThreadPoolExecutor
 from .d3_graph import neo4j_to_d3
+from .pipeline_query import pipeline_graph_query, pipeline_graph_parameters, pipeline_sample_query
+from .queries import register
+
+neo4j_obj = get_connection()
+
+# Threads running the branch queries of a search concurrently, shared by all requests.
+# Each thread borrows its own connection from the driver pool.
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", 8))
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix='search')
+
+# Pipelines expanded per matched item, one row per pipeline (see pipeline_query.py)
+SEARCH_PIPELINES_PER_ITEM = int(os.getenv("SEARCH_PIPELINES_PER_ITEM", 20))
+# Guardrails of user-written Cypher (/search/cypher_query)
+CYPHER_QUERY_TIMEOUT = float(os.getenv("CYPHER_QUERY_TIMEOUT", 30))  # seconds, enforced by the server
+CYPHER_MAX_RECORDS = int(os.getenv("CYPHER_MAX_RECORDS", 5000))
+CYPHER_MAX_NODES = int(os.getenv("CYPHER_MAX_NODES", 2000))
+CYPHER_MAX_LINKS = int(os.getenv("CYPHER_MAX_LINKS", 5000))
+
+SEARCH_QUERIES = {
+    entity: register('search.{}'.format(entity),
+                     pipeline_graph_query(label, "MATCH (root:%s {name:$name})" % label),
+                     pipeline_graph_parameters(pipelines_per_item=SEARCH_PIPELINES_PER_ITEM, name=''),
+                     samples={'name': pipeline_sample_query(label, 'name')})
+    for entity, label in [('task', 'Task'), ('dataset', 'Dataset'), ('model', 'Model')]
+}
+
+# Search without any item: a sample of complete pipelines
+SAMPLE_QUERY = register('search.sample', """
+        MATCH (met:Metric)-[r1]-(a:Artifact)-[r2]-(e:Execution)-[r3]-(s:Stage)-[r4]-(p:Pipeline)-[r5]-(t:Task)
+        WITH met, a, e, s, p, t, r1, r2, r3, r4, r5
+        MATCH (d:Dataset)-[r6]-(a)-[r7]-(m:Model)
+        WITH d, a, m, e, s, p, t, met, r1, r2, r3, r4, r5, r6, r7 limit 100
+        RETURN collect(DISTINCT d) + collect(DISTINCT a) + collect(DISTINCT m) + collect(DISTINCT e) + collect(DISTINCT s) +
+               collect(DISTINCT p) + collect(DISTINCT t) + collect(DISTINCT met) AS nodes,
+               collect(DISTINCT r1) + collect(DISTINCT r2) + collect(DISTINCT r3) + collect(DISTINCT r4) + collect(DISTINCT r5) +
+               collect(DISTINCT r6) + collect(DISTINCT r7) AS links
+        """)
+
 
-load_dotenv()
-URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
-USER = os.getenv("NEO4J_USER_NAME")
-PASSWORD = os.getenv("NEO4J_PASSWD")
-AUTH = (os.getenv("NEO4J_USER_NAME"), os.getenv("NEO4J_PASSWD"))
-
-# Instantiate Neo4j connection
-neo4j_obj = Neo4jConnection(uri=URI, 
-                    user=USER,
-                    pwd=PASSWORD)
-
-
-def neo4j_to_names(result, limit=1000):
-    names_list = []
-    for item in result:
-        curr_dict = dict(item[0])
-        names_list.append(curr_dict['name'])
-    if limit is None:
-        names_list.sort()
-        return names_list
-    else:
-        names_list = list(set(names_list))
-        if '' in names_list:
-            names_list.remove('')
-        # random.shuffle(names_list)
-        names_list = names_list[:limit]
-        names_list.sort()
-        return names_list
-
-
-def drop_down_values(limit=1000):
-
-    task_query = """MATCH (n:Task) return properties(n)"""
-    task_res = neo4j_obj.query(task_query)
-    task_names = neo4j_to_names(task_res, limit=limit)
-
-    dataset_query = """MATCH (n:Dataset) return properties(n)"""
-    dataset_res = neo4j_obj.query(dataset_query)
-    dataset_names = neo4j_to_names(dataset_res, limit=limit)
-    dataset_names.append('CalTech 101 Silhouettes')
-
-    model_query = """MATCH (n:Model) return properties(n)"""
-    model_res = neo4j_obj.query(model_query)
-    model_names = neo4j_to_names(model_res,limit=limit)
-    return {'task': task_names, 'dataset': dataset_names, 'model': model_names}
+def run_queries(queries):
+    """
+    Run independent (registered statement, parameters) pairs concurrently and return their results in the same order,
+    so the latency is that of the slowest query rather than the sum of all of them.
+    """
+    if len(queries) <= 1:
+        return [statement.run(parameters) for statement, parameters in queries]
+    futures = [search_executor.submit(statement.run, parameters) for statement, parameters in queries]
+    return [future.result() for future in futures]
 
 
 def get_OR_query_results(task=None, dataset=None, model=None):
-    results = []
+    # branch queries, run concurrently below
+    queries = []
 
     if task != "None":
-        task_query ="""MATCH (task:Task {name:$task_name})
-            OPTIONAL MATCH (task)-[r1]-(pipeline:Pipeline)
-            OPTIONAL MATCH (pipeline)-[r2]-(stage:Stage)
-            OPTIONAL MATCH (stage)-[r3]-(execution:Execution)
-            OPTIONAL MATCH (execution)-[r4]-(artifact:Artifact)
-            OPTIONAL MATCH (artifact)-[r5]-(dataset:Dataset)
-            OPTIONAL MATCH (artifact)-[r6]-(model:Model)
-            OPTIONAL MATCH (artifact)-[r7]-(metric:Metric)
-            OPTIONAL MATCH (pipeline)-[r8]-(framework:Framework)
-            OPTIONAL MATCH (pipeline)-[r9]-(report:Report)
-            RETURN task, pipeline, stage, execution, artifact, dataset, model, metric, framework, report, r1, r2, r3, r4, r5, r6, r7, r8, r9
-            limit 100"""
-        task_parameters = {'task_name': task}
-        task_res = neo4j_obj.query(task_query, parameters=task_parameters)
-        results.append(task_res)
+        task_query = SEARCH_QUERIES['task']
+        task_parameters = pipeline_graph_parameters(pipelines_per_item=SEARCH_PIPELINES_PER_ITEM, name=task)
+        queries.append((task_query, task_parameters))
 
     if dataset != "None":
-        dataset_query ="""MATCH (dataset:Dataset {name:$dataset_name})
-            OPTIONAL MATCH (dataset)-[r5]-(artifact:Artifact)
-            OPTIONAL MATCH (artifact)-[r6]-(model:Model)
-            OPTIONAL MATCH (artifact)-[r7]-(metric:Metric)
-            OPTIONAL MATCH (artifact)-[r4]-(execution:Execution)
-            OPTIONAL MATCH (execution)-[r3]-(stage:Stage)
-            OPTIONAL MATCH (stage)-[r2]-(pipeline:Pipeline)
-            OPTIONAL MATCH (pipeline)-[r1]-(task:Task)
-            OPTIONAL MATCH (pipeline)-[r8]-(framework:Framework)
-            OPTIONAL MATCH (pipeline)-[r9]-(report:Report)
-            RETURN task, pipeline, stage, execution, artifact, dataset, model, metric, framework, report, r1, r2, r3, r4, r5, r6, r7, r8, r9
-            limit 100"""
-        dataset_parameters = {'dataset_name': dataset}
-        dataset_res = neo4j_obj.query(dataset_query, parameters=dataset_parameters)
-        results.append(dataset_res)
+        dataset_query = SEARCH_QUERIES['dataset']
+        dataset_parameters = pipeline_graph_parameters(pipelines_per_item=SEARCH_PIPELINES_PER_ITEM, name=dataset)
+        queries.append((dataset_query, dataset_parameters))
 
     if model != "None":
-        model_query ="""MATCH (model:Model {name:$model_name})
-            OPTIONAL MATCH (task:Task)-[r1]-(pipeline:Pipeline)
-            OPTIONAL MATCH (pipeline)-[r2]-(stage:Stage)
-            OPTIONAL MATCH (stage)-[r3]-(execution:Execution)
-            OPTIONAL MATCH (execution)-[r4]-(artifact:Artifact)
-            OPTIONAL MATCH (artifact)-[r5]-(dataset:Dataset)
-            OPTIONAL MATCH (artifact)-[r6]-(model)
-            OPTIONAL MATCH (artifact)-[r7]-(metric:Metric)
-            OPTIONAL MATCH (pipeline)-[r8]-(framework:Framework)
-            OPTIONAL MATCH (pipeline)-[r9]-(report:Report)
-            RETURN task, pipeline, stage, execution, artifact, dataset, model, metric, framework, report, r1, r2, r3, r4, r5, r6, r7, r8, r9
-            limit 100"""
-        model_parameters = {'model_name': model}
-        model_res = neo4j_obj.query(model_query, parameters=model_parameters)
-        results.append(model_res)
+        model_query = SEARCH_QUERIES['model']
+        model_parameters = pipeline_graph_parameters(pipelines_per_item=SEARCH_PIPELINES_PER_ITEM, name=model)
+        queries.append((model_query, model_parameters))
     
     if task == "None" and dataset == "None" and model == "None":
-        query_str = """
-        MATCH (met:Metric)-[r1]-(a:Artifact)-[r2]-(e:Execution)-[r3]-(s:Stage)-[r4]-(p:Pipeline)-[r5]-(t:Task)
-        WITH met, a, e, s, p, t, r1, r2, r3, r4, r5
-        MATCH (d:Dataset)-[r6]-(a)-[r7]-(m:Model)
-        RETURN d, a, m, e, s, p, t, met, r1, r2, r3, r4, r5, r6, r6 limit 100
-        """
-        res = neo4j_obj.query(query_str)
-        results.append(res)
+        queries.append((SAMPLE_QUERY, None))
 
+    results = run_queries(queries)
     return results
 
 
@@ -140,14 +102,30 @@ def search_pipelines(query_task=None, query_dataset=None, query_model=None, quer
     if query_type == 'OR':
         results = get_OR_query_results(task=query_task, dataset=query_dataset, model=query_model)
         if results == []:
-            return {'nodes':[], 'links':[]} 
+            return {'nodes':[], 'links':[], 'truncated': False}
         else:
             res_d3_graphs = neo4j_to_d3(results) 
             return res_d3_graphs
     
 
 def search_custom_query(query_str):
-    result = neo4j_obj.query(query_str)
-    result = [result] # neo4j_d3_graph handles list of graphs. So expects result in list of neo4j_records format
-    result_d3_graph = neo4j_to_d3(result)
+    """
+    Run user-written Cypher with guardrails: read-only transaction, server-side timeout, and record, node and link caps.
+    Records are streamed into the converter, which stops at the first cap and sets "truncated"; the rest of the
+    result is discarded when the stream is closed. Errors (writes, syntax, timeout) are returned under "error";
+    driver-side failures (database unavailable, session expired) also set "unavailable".
+    """
+    result = neo4j_obj.stream(query_str, access_mode='read', timeout=CYPHER_QUERY_TIMEOUT,
+                              fetch_size=min(NEO4J_FETCH_SIZE, CYPHER_MAX_RECORDS))
+    try:
+        result_d3_graph = neo4j_to_d3([result], max_records=CYPHER_MAX_RECORDS, max_nodes=CYPHER_MAX_NODES,
+                                      max_links=CYPHER_MAX_LINKS) # neo4j_d3_graph handles list of graphs
+    except Neo4jError as e:
+        return {'nodes': [], 'links': [], 'truncated': False, 'error': e.message}
+    except DriverError as e:
+        return {'nodes': [], 'links': [], 'truncated': False, 'error': str(e) or type(e).__name__, 'unavailable': True}
+    finally:
+        result.close()
+    if result_d3_graph['truncated']:
+        print("Cypher query result truncated to {} nodes, {} links".format(len(result_d3_graph['nodes']), len(result_d3_graph['links'])))
     return result_d3_graph
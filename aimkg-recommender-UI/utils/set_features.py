@@ -0,0 +1,82 @@
+###
+# Copyright (2024) Hewlett Packard Enterprise Development LP
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+###
+
+"""
+Sparse set features (name tokens, modality, category) used by the rankers.
+Replaces the per-item IOU loops: the intersection with a query set for all items is one
+sparse matrix-vector product, and the union follows from the precomputed set sizes.
+"""
+
+import torch
+from .embedding_index import DEVICE
+
+
+class SetFeatureMatrix:
+    """
+    Binary item x vocabulary matrix (CSR) built from one set of values per item.
+    Used for token vocabularies as well as the multi-hot modality and category features.
+    """
+    def __init__(self, item_sets):
+        vocab = {}
+        crow_indices = [0]
+        col_indices = []
+        sizes = []
+        for item_set in item_sets:
+            values = set(item_set)
+            for value in values:
+                col_indices.append(vocab.setdefault(value, len(vocab)))
+            crow_indices.append(len(col_indices))
+            sizes.append(len(values))
+
+        self.vocab = vocab
+        self.matrix = torch.sparse_csr_tensor(torch.tensor(crow_indices, dtype=torch.int64),
+                                              torch.tensor(col_indices, dtype=torch.int64),
+                                              torch.ones(len(col_indices), dtype=torch.float32),
+                                              size=(len(sizes), max(len(vocab), 1))).to(DEVICE)
+        self.sizes = torch.tensor(sizes, dtype=torch.float32, device=DEVICE)
+
+    def query_vector(self, query_set):
+        query = torch.zeros(self.matrix.shape[1], dtype=torch.float32)
+        columns = [self.vocab[value] for value in set(query_set) if value in self.vocab]
+        query[columns] = 1.0
+        return query.to(DEVICE)
+
+    def intersection(self, query_set, rows=None):
+        query = self.query_vector(query_set)
+        if rows is None:
+            return (self.matrix @ query.view(-1, 1)).view(-1)
+        # only the given rows: gather their columns from the CSR arrays and sum the query hits per row
+        crow_indices, col_indices = self.matrix.crow_indices(), self.matrix.col_indices()
+        starts = crow_indices[rows]
+        lengths = crow_indices[rows + 1] - starts
+        owner = torch.repeat_interleave(torch.arange(rows.shape[0], device=DEVICE), lengths)
+        offsets = torch.arange(owner.shape[0], device=DEVICE) - (torch.cumsum(lengths, 0) - lengths)[owner]
+        hits = query[col_indices[starts[owner] + offsets]]
+        return torch.zeros(rows.shape[0], dtype=torch.float32, device=DEVICE).index_add_(0, owner, hits)
+
+    def jaccard(self, query_set, rows=None):
+        """
+        IOU of the query set with the set of every item, in item order, or of the given rows only
+        (1-d int64 tensor of row numbers), in the order of `rows`.
+        Query values outside the vocabulary never intersect but still count towards the union.
+        """
+        inter = self.intersection(query_set, rows=rows)
+        sizes = self.sizes if rows is None else self.sizes[rows]
+        union = sizes + len(set(query_set)) - inter
+        return inter / union.clamp_min(1.0)
+
+    def __len__(self):
+        return self.matrix.shape[0]
@@ -22,39 +22,21 @@ super_class = ['image', 'text', 'video', 'audio']
 
 
 
-from .neo4j_connection import Neo4jConnection
-from .d3_graph import neo4j_to_d3
-from dotenv import load_dotenv
+from .neo4j_connection import get_connection
+from .pipeline_query import pipeline_graph_query, pipeline_graph_parameters, pipeline_sample_query
+from .queries import register
+from .pipeline_cards import result_graph
+from .node_catalog import NodeCatalog
+from .feature_store import FeatureStore
+from .scoring import HybridScorer
 import os
-import torch
-from sentence_transformers import SentenceTransformer
-import torch.nn.functional as F
 import time
-import h5py
-import glob
 
-DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-# DEVICE = torch.device("cpu")
-embedding_model = SentenceTransformer("all-mpnet-base-v2").to(DEVICE)
 
-load_dotenv()
-URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
-USER = os.getenv("NEO4J_USER_NAME")
-PASSWORD = os.getenv("NEO4J_PASSWD")
-AUTH = (os.getenv("NEO4J_USER_NAME"), os.getenv("NEO4J_PASSWD"))
+neo4j_obj = get_connection()
 
-# Instantiate Neo4j connection
-neo4j_obj = Neo4jConnection(uri=URI, 
-                    user=USER,
-                    pwd=PASSWORD)
 
 
-def find_file_path(filename, search_directory="."):
-    # Use glob to search recursively in the current directory for the file
-    for file_path in glob.iglob(f"{search_directory}/**/{filename}", recursive=True):
-        return os.path.abspath(file_path)
-    return None
-
 def compute_category(item_tokens):
     tokens = list(item_tokens)
     inter = list(set(tokens).intersection(set(task_category_vocab)))
@@ -106,49 +88,34 @@ def create_tokens(tid):
     tokens = [t.lower() for t in tokens_]
     return tokens
 
-def convert_json(result):
-    data_dict = {}
-    for item in result:
-        curr_dict = dict(item[0])
-        # if curr_dict['source'] == 'papers-with-code' or curr_dict['source'] == 'huggingface':
-        item_id = curr_dict['itemID']
-        name = curr_dict['name']
-        curr_dict['tokens'] = create_tokens(name)
-        data_dict[item_id] = curr_dict
-    return data_dict
+task_catalog = NodeCatalog(neo4j_obj, 'Task', create_tokens)
+task_features = FeatureStore('task', task_catalog, {
+    'tokens': lambda node: node['tokens'],
+    'modality': lambda node: node.get('modality', 'none').split(","),
+    'category': lambda node: node.get('category', 'none').split(","),
+})
 
 def get_tasks():
-    get_task_nodes= """MATCH (n:Task) RETURN properties(n)""" 
-    res = neo4j_obj.query(get_task_nodes)
-    task_dict = convert_json(res)
+    task_dict = task_catalog.refresh().nodes
     return task_dict
 
 
 
+# pipeline expansion of the top tasks, built once
+RESULT_PIPELINES_QUERY = register('task.result_pipelines',
+                                  pipeline_graph_query('Task', "UNWIND $ids AS id MATCH (root:Task {itemID:id})"),
+                                  pipeline_graph_parameters(ids=[]), samples={'ids': pipeline_sample_query('Task')})
+
+
 def get_result_pipelines(task_ids):
     """
-    For the given task ids (top similar ones) get the entire pipeline and return to the main function
+    For the given task ids (top similar ones) get the entire pipeline and return to the main function.
+    All ids are expanded in a single round-trip, one row per (task, pipeline), see pipeline_query.py.
+    Returns the records, as a list of results for neo4j_to_d3
     """
-    results = []
-    for tid in task_ids:
-        query_str = """
-            MATCH (task:Task {itemID:$task_id})
-            OPTIONAL MATCH (task)-[r1]-(pipeline:Pipeline)
-            OPTIONAL MATCH (pipeline)-[r2]-(stage:Stage)
-            OPTIONAL MATCH (stage)-[r3]-(execution:Execution)
-            OPTIONAL MATCH (execution)-[r4]-(artifact:Artifact)
-            OPTIONAL MATCH (artifact)-[r5]-(dataset:Dataset)
-            OPTIONAL MATCH (artifact)-[r6]-(model:Model)
-            OPTIONAL MATCH (artifact)-[r7]-(metric:Metric)
-            OPTIONAL MATCH (pipeline)-[r8]-(framework:Framework)
-            OPTIONAL MATCH (pipeline)-[r9]-(report:Report)
-            RETURN task, pipeline, stage, execution, artifact, dataset, model, metric, framework, report, r1, r2, r3, r4, r5, r6, r7, r8, r9
-            limit 20
-            """
-        parameters = {'task_id':tid}
-        res = neo4j_obj.query(query_str, parameters)
-        results.append(res)
-    return results
+    parameters = pipeline_graph_parameters(ids=list(task_ids))
+    res = RESULT_PIPELINES_QUERY.run(parameters)
+    return [res]
 
 
 def get_explanations(query_task, top_task_ids, top_sim_scores, task_dict):
@@ -165,85 +132,44 @@ def get_explanations(query_task, top_task_ids, top_sim_scores, task_dict):
     return explanations
 
 
-def compute_IOU(tokens1, tokens2):
-    return len(set(tokens1).intersection(tokens2))/len(set(tokens1).union(tokens2))
+def get_token_sim(features, query_task, rows=None):
+    query_tokens = create_tokens(query_task)
+    return features.jaccard('tokens', query_tokens, rows=rows)
 
 
-def get_token_sim(query_task, task_dict):
-    query_tokens = create_tokens(query_task)
-    sims = []
-    for id in task_dict:
-        sims.append(compute_IOU(query_tokens, task_dict[id]['tokens']))
-    return sims
-
-
-def get_modality_sim(query_task, task_dict):
-    query_modality = compute_modality(query_task)
-    sims = []
-    for id in task_dict:
-        sims.append(compute_IOU(query_modality.split(","), task_dict[id]['modality'].split(",")))
-    return sims
-
-
-def get_category_sim(query_task, task_dict):
-    query_category= compute_category(query_task)
-    sims = []
-    for id in task_dict:
-        sims.append(compute_IOU(query_category.split(","), task_dict[id]['category'].split(",")))
-    return sims
-
-def get_task_nodes(task_id):
-    get_task_nodes= """MATCH (n:Task {itemID:$id}) RETURN properties(n)""" 
-    parameters = {'id':task_id}
-    res = neo4j_obj.query(get_task_nodes, parameters)
-    task_dict = convert_json(res)
-    return task_dict
+def get_modality_sim(features, query_task, rows=None):
+    query_modality = compute_modality(create_tokens(query_task))
+    return features.jaccard('modality', query_modality.split(","), rows=rows)
+
+
+def get_category_sim(features, query_task, rows=None):
+    query_category = compute_category(create_tokens(query_task))
+    return features.jaccard('category', query_category.split(","), rows=rows)
+
 
-def get_similar_tasks(query_task, num_res=3):
+task_scorer = HybridScorer(task_features, {'tokens': get_token_sim, 'modality': get_modality_sim, 'category': get_category_sim})
+
+
+def get_similar_tasks(query_task, num_res=3, sim_threshold=None):
     start_time = time.time()
     num_res=3
     # check if we are able to calculate modality or category
     # if there are values, then pass this as constraint and pick only those tasks for similarity computation
-    # Or, use the stored files and compute cosine similarity.. pick top 200 results and compute custom similarity only for those?
+    # The custom similarity is computed only for the top RERANK_CANDIDATES embedding results, see scoring.py
     # have the option to include or exclude modality and category computation in similarity calculation if category and modality are not available
     
     # test - compute just embedding similarity from all the files
-    task_dict = get_tasks()
-
-
-    filename = 'task_embeddings_all.h5'
-    filepath = find_file_path(filename=filename)
-    with h5py.File(filepath, 'r') as f:
-        # Load the datasets
-        embedding_ids = f['embedding_ids'][:]  # Reads all the IDs
-        embeddings = f['embeddings'][:]    
-
-    task_ids = [id.decode('utf-8') for id in embedding_ids]  # Decode if IDs are stored as byte strings
-    embeddings = torch.tensor(embeddings).to(DEVICE)  # Convert embeddings to a torch tensor
-
-    query_embedding = torch.tensor(embedding_model.encode(str(query_task))).view(1, -1).to(DEVICE)
-
-    cos_sim =  F.cosine_similarity(query_embedding, embeddings, dim=1)
-    token_sim = torch.tensor(get_token_sim(query_task, task_dict)).to(DEVICE)
-    modality_sim = torch.tensor(get_modality_sim(query_task, task_dict)).to(DEVICE)
-    category_sim = torch.tensor(get_category_sim(query_task, task_dict)).to(DEVICE)
-
-    mean_sim = (cos_sim + token_sim + modality_sim + category_sim) / 4
+    state = task_scorer.refresh()
+    task_dict = state.features.nodes
 
-    # Sort the tensor in descending order and get the indices
-    sorted_tensor, sorted_indices = torch.sort(mean_sim, descending=True)
     print("task.py", num_res)
-    indices = sorted_indices[:num_res]
-    top_task_ids = [task_ids[idx] for idx in indices]
-    top_sim_scores = sorted_tensor[:num_res]
+    top_task_ids, top_sim_scores = task_scorer.top_k(query_task, num_res, threshold=sim_threshold, state=state)
     explanations = get_explanations(query_task, top_task_ids, top_sim_scores, task_dict)
-    neo4j_results = get_result_pipelines(top_task_ids)
-    result_d3_graphs = neo4j_to_d3(neo4j_results)
+    result_d3_graphs = result_graph('Task', top_task_ids, get_result_pipelines)
+    task_nodes = task_catalog.get_many(top_task_ids)
     result_items = {'nodes': result_d3_graphs['nodes'], 'links':result_d3_graphs['links'], 'explanations':explanations}
     print("Time Taken:",time.time()-start_time)
-    similar_item_dict = []
-    for id in top_task_ids:
-        similar_item_dict.append(get_task_nodes(id))
+    similar_item_dict = [{id: task_nodes[id]} for id in top_task_ids if id in task_nodes]
     return result_items, similar_item_dict
 
 # get_similar_tasks("medical image segmentation")
\ No newline at end of file